@@ -1,28 +1,114 @@
 # Highlight Extraction App
-from flask import Flask, render_template, request
+from flask import Flask, jsonify, render_template, request
 
 # Testing Below
 # ---------------
-import json
 import os
-import re
+import threading
 
-import pandas as pd
-import numpy as np
-import spacy
-import os
-import nltk.data
+from scidt_repo.jobs import JobStore, JobWorkers
+from scidt_repo.highlights import select_highlights, job_result
 
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
-from scidt_repo.extract_highlights import HighlightExtractor
 
-h = HighlightExtractor('models/scibert_scivocab_uncased', 'models/tagger', bidirectional=True)
-tokenizer = nltk.data.load('tokenizers/punkt/english.pickle')
+# /readyz REPORTS 503 UNTIL THE MODELS ARE LOADED AND EVERY SHAPE BUCKET HAS RUN ONCE
+ready = threading.Event()
+h = None
+tagger = None
+
+if os.environ.get('INFERENCE_SOCKET'):
+    # THIN CLIENT | THE MODELS LIVE IN A SEPARATE SIDECAR PROCESS (python -m scidt_repo.sidecar)
+    from scidt_repo.sidecar import SidecarClient
+    tagger = SidecarClient(os.environ['INFERENCE_SOCKET'])
+
+    def load_models():
+        # the sidecar loads the models
+        pass
+
+    def warmup():
+        # the sidecar warms itself up
+        pass
+
+    def is_ready():
+        return tagger.ready()
+else:
+    from scidt_repo.batching import MicroBatcher
+    from scidt_repo.result_cache import MemoryBackend, DiskBackend
+    from scidt_repo.segmentation import get_nlp
+
+    def load_models():
+        # TENSORFLOW IS ONLY IMPORTED HERE, IN THE PROCESS THAT SERVES | ITS RUNTIME DOES NOT SURVIVE A FORK
+        global h, tagger
+        from scidt_repo.extract_highlights import HighlightExtractor
+
+        # REPEAT SUBMISSIONS OF THE SAME PAPER ARE SERVED FROM THE RESULT CACHE
+        if os.environ.get('RESULT_CACHE_DIR'):
+            result_cache_backend = DiskBackend(os.environ['RESULT_CACHE_DIR'],
+                                               max_entries=int(os.environ.get('RESULT_CACHE_SIZE', 10000)))
+        else:
+            result_cache_backend = MemoryBackend(max_entries=int(os.environ.get('RESULT_CACHE_SIZE', 256)))
+
+        h = HighlightExtractor('models/scibert_scivocab_uncased', 'models/tagger', bidirectional=True,
+                               embedding_cache_path=os.environ.get('EMBEDDING_CACHE_PATH'),
+                               result_cache_backend=result_cache_backend,
+                               result_cache_ttl=float(os.environ.get('RESULT_CACHE_TTL', 24 * 60 * 60)),
+                               numpy_head=os.environ.get('NUMPY_HEAD', '1') == '1',
+                               compiled=os.environ.get('COMPILED_INFERENCE', '1') == '1')
+        # COALESCE CONCURRENT REQUESTS INTO SHARED MODEL BATCHES
+        tagger = MicroBatcher(h, max_wait_ms=float(os.environ.get('BATCH_WAIT_MS', 10)),
+                              max_sentences=int(os.environ.get('BATCH_MAX_SENTENCES', 300)))
+
+    def warmup():
+        h.warmup()
+        ready.set()
+
+    def is_ready():
+        return ready.is_set()
+
+
+def clean_text(inputText):
+    cleanText = inputText.replace('\n', ' ').replace('\r', '')
+    encodeText = cleanText.encode("ascii", "ignore")
+    return encodeText.decode()
+
+
+def run_job(payload):
+    return job_result(tagger, payload)
+
+
+# ASYNC JOBS | QUEUED IN SQLITE SO THEY SURVIVE RESTARTS, RUN BY A SMALL POOL OF THREADS IN EACH WORKER
+jobs = JobWorkers(JobStore(os.environ.get('JOBS_DB_PATH', 'jobs.sqlite')), run_job,
+                  num_workers=int(os.environ.get('JOB_WORKERS', 2)))
+max_queued_jobs = int(os.environ.get('JOB_MAX_QUEUED', 1000))
+
+
+if os.environ.get('DEFER_MODEL_LOAD') == '1':
+    # A GUNICORN MASTER ONLY LOADS THE spaCy PIPELINES, WHICH ITS FORKED WORKERS SHARE. EACH WORKER LOADS
+    # THE TENSORFLOW MODELS AND WARMS UP BEFORE IT ACCEPTS REQUESTS (SEE gunicorn.conf.py)
+    if not os.environ.get('INFERENCE_SOCKET'):
+        get_nlp(tense=False)
+        get_nlp(tense=True)
+else:
+    load_models()
+    threading.Thread(target=warmup, name='warmup', daemon=True).start()
+    jobs.start()
 # ---------------
 
 app = Flask(__name__)
 
 
+@app.route('/healthz')
+def healthz():
+    return 'ok', 200
+
+
+@app.route('/readyz')
+def readyz():
+    if is_ready():
+        return 'ready', 200
+    return 'warming up', 503
+
+
 @app.route('/')
 def main():
     return render_template('app.html')
@@ -32,135 +118,32 @@ def main():
 def send(sum=sum):
     if request.method == 'POST':
         inputText = request.form['highlightArea']
-        cleanText = inputText.replace('\n', ' ').replace('\r', '')
-        encodeText = cleanText.encode("ascii", "ignore")
-        decodeText = encodeText.decode()
-
-        # CONVERT USER INPUT INTO SENTENCES
-        allSentences = tokenizer.tokenize(decodeText)
-
-        # SPLIT SENTENCES INTO LISTS | 40 SENTENCES PER LIST IS MAX (USING 30 TO ACCOMMODATE ABBREVIATIONS MID SENTENCE)
-        l1 = allSentences[0:30]
-        l2 = allSentences[30:60]
-        l3 = allSentences[60:90]
-        l4 = allSentences[90:120]
-        l5 = allSentences[120:150]
-        l6 = allSentences[150:180]
-        l7 = allSentences[150:180]
-        l8 = allSentences[180:210]
-        l9 = allSentences[210:240]
-        l10 = allSentences[240:270]
-        l11 = allSentences[270:300]
-
-        # SPLIT SENTENCES INTO LISTS | 40 SENTENCES PER LIST
-        string1 = ' '.join([str(elem) for elem in l1])
-        string2 = ' '.join([str(elem) for elem in l2])
-        string3 = ' '.join([str(elem) for elem in l3])
-        string4 = ' '.join([str(elem) for elem in l4])
-        string5 = ' '.join([str(elem) for elem in l5])
-        string6 = ' '.join([str(elem) for elem in l6])
-        string7 = ' '.join([str(elem) for elem in l7])
-        string8 = ' '.join([str(elem) for elem in l8])
-        string9 = ' '.join([str(elem) for elem in l9])
-        string10 = ' '.join([str(elem) for elem in l10])
-        string11 = ' '.join([str(elem) for elem in l11])
-
-        if len(string1) > 0:
-            tag1 = h.tag(string1, parsed=False)
-        else:
-            tag1 = pd.DataFrame()
-
-        if len(string2) > 0:
-            tag2 = h.tag(string2, parsed=False)
-        else:
-            tag2 = pd.DataFrame()
-
-        if len(string3) > 0:
-            tag3 = h.tag(string3, parsed=False)
-        else:
-            tag3 = pd.DataFrame()
-
-        if len(string4) > 0:
-            tag4 = h.tag(string4, parsed=False)
-        else:
-            tag4 = pd.DataFrame()
-        if len(string5) > 0:
-            tag5 = h.tag(string5, parsed=False)
-        else:
-            tag5 = pd.DataFrame()
-        if len(string6) > 0:
-            tag6 = h.tag(string6, parsed=False)
-        else:
-            tag6 = pd.DataFrame()
-        if len(string7) > 0:
-            tag7 = h.tag(string7, parsed=False)
-        else:
-            tag7 = pd.DataFrame()
-        if len(string8) > 0:
-            tag8 = h.tag(string8, parsed=False)
-        else:
-            tag8 = pd.DataFrame()
-        if len(string9) > 0:
-            tag9 = h.tag(string9, parsed=False)
-        else:
-            tag9 = pd.DataFrame()
-        if len(string10) > 0:
-            tag10 = h.tag(string10, parsed=False)
-        else:
-            tag10 = pd.DataFrame()
-        if len(string11) > 0:
-            tag11 = h.tag(string11, parsed=False)
-        else:
-            tag11 = pd.DataFrame()
-
-        # a = h.tag(decodeText, parsed=False)
-
-        # COMBINE TAGGED SENTENCES & SORT
-        allTags = [tag1, tag2, tag3, tag4, tag5, tag6, tag7, tag8, tag9, tag10, tag11]
-        finalTags = pd.concat(allTags)
-
-        # SUBSET BASED ON TAG
-        implications = finalTags[(finalTags['tag'] == 'implication') & (finalTags['prob'] > .50)].sort_values(by='prob',
-                                                                                                              ascending=False).head(
-            2)
-        implications = implications.sort_values(by='prob', ascending=True)
-
-        results = finalTags[
-            (finalTags['tag'] == 'result') & (finalTags['prob'] > .50) & (finalTags['prob'] < .95)].sort_values(
-            by='prob', ascending=False).head(1)
-
-        methodsHigh = finalTags[(finalTags['tag'] == 'method') & (finalTags['prob'] > .50)].sort_values(by='prob',
-                                                                                                        ascending=False).head(
-            1)
-        methodsLow = finalTags[
-            (finalTags['tag'] == 'method') & (finalTags['prob'] > .40) & (finalTags['prob'] < .46) & (
-                finalTags['sentence'].str.len().between(100, 150))].sort_values(by='prob', ascending=False).head(1)
-
-        methodsAll = [methodsHigh, methodsLow]
-        methods = pd.concat(methodsAll).sort_values(by='prob', ascending=True)
-
-        # MERGE FINAL DF
-        finalHighlightStage = [methods, results, implications]
-        finalHighlights = pd.concat(finalHighlightStage)
-
-        # RETURN 5 HIGHLIGHTS
-        finalTagsSorted = finalTags.sort_values('prob')
-
-        if len(finalHighlights) == 0:
-            finalHighlights = finalTagsSorted.sentence.tail(5).tolist()
-        elif len(finalHighlights) == 1:
-            finalHighlights = pd.concat([finalHighlights, finalTagsSorted.sentence.tail(4).tolist()])
-        elif len(finalHighlights) == 2:
-            finalHighlights = pd.concat([finalHighlights, finalTagsSorted.sentence.tail(3).tolist()])
-        elif len(finalHighlights) == 3:
-            finalHighlights = pd.concat([finalHighlights, finalTagsSorted.sentence.tail(2).tolist()])
-        elif len(finalHighlights) == 4:
-            finalHighlights = pd.concat([finalHighlights, finalTagsSorted.sentence.tail(1).tolist()])
-        else:
-            finalHighlights = finalHighlights.sentence.tail(5).tolist()
+        decodeText = clean_text(inputText)
 
-            # finalHighlights = finalHighlights + finalTagsSorted.sentence.tail(4).tolist()
+        # TAG THE WHOLE PAPER | LONG PAPERS ARE TAGGED IN OVERLAPPING 40-SENTENCE WINDOWS AND STITCHED
+        # (TENSE IS NOT SHOWN, SO SKIP IT)
+        finalTags = tagger.tag(decodeText, parsed=False, lazy_tense=True)
 
         # sum = finalHighlights.sentence.tail(5).tolist()
-        sum = finalHighlights
-        return render_template('app.html', sum=sum)
\ No newline at end of file
+        sum = select_highlights(finalTags)
+        return render_template('app.html', sum=sum)
+
+
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    body = request.get_json(silent=True) or {}
+    inputText = body.get('text') or request.form.get('highlightArea')
+    if not inputText:
+        return jsonify(error='Expected a "text" field'), 400
+    if jobs.store.count('queued') >= max_queued_jobs:
+        return jsonify(error='Too many queued jobs, try again later'), 503, {'Retry-After': '30'}
+    job_id = jobs.submit({'text': clean_text(inputText)})
+    return jsonify(id=job_id, status='queued'), 202, {'Location': '/api/jobs/' + job_id}
+
+
+@app.route('/api/jobs/<job_id>')
+def job_status(job_id):
+    job = jobs.store.get(job_id)
+    if job is None:
+        return jsonify(error='No such job'), 404
+    return jsonify(job)
@@ -0,0 +1,71 @@
+# Preload-and-fork serving: the master imports the app and loads the spaCy pipelines once, freezes
+# the heap and forks the workers, which share those read-only pages copy-on-write. TensorFlow's
+# runtime (its thread pools and allocator state) does not survive a fork, so SciBERT and the
+# tagger are loaded by every worker after the fork, and warmed up before it accepts connections.
+#
+#     gunicorn -c gunicorn.conf.py wsgi:app
+#
+# That is one copy of the models per worker. To run several workers on one host with a single
+# copy, start the inference sidecar and point the workers at its socket; they then load no
+# TensorFlow at all and send every document to the sidecar, which batches them together:
+#
+#     python -m scidt_repo.sidecar --socket_path /tmp/highlights.sock --bidirectional &
+#     INFERENCE_SOCKET=/tmp/highlights.sock gunicorn -c gunicorn.conf.py wsgi:app
+import gc
+import os
+import threading
+
+bind = os.environ.get('BIND', '0.0.0.0:80')
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+# a few threads per worker, so its MicroBatcher has concurrent requests to coalesce
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+preload_app = os.environ.get('PRELOAD_APP', '1') == '1'
+
+# importing the app (in the master when preloading) never loads TensorFlow; see post_worker_init
+os.environ['DEFER_MODEL_LOAD'] = '1'
+
+if preload_app:
+    # no collections while the pipelines load, so their objects aren't shuffled between generations
+    gc.disable()
+
+
+def when_ready(server):
+    if preload_app:
+        # Move everything loaded so far into the permanent generation. Later collections in the
+        # workers never touch (and so never copy) the pages holding those objects.
+        gc.freeze()
+        gc.enable()
+    if workers > 1 and not os.environ.get('INFERENCE_SOCKET'):
+        server.log.warning("Each of the %d workers loads its own copy of the models; set INFERENCE_SOCKET "
+                           "to share one inference sidecar between them", workers)
+
+
+def post_fork(server, worker):
+    # Split the cores between the workers. TF reads these when its runtime starts, which is in
+    # this worker, so each one sizes its own thread pools.
+    threads_per_worker = str(max(1, (os.cpu_count() or 1) // workers))
+    os.environ.setdefault('TF_NUM_INTRAOP_THREADS', threads_per_worker)
+    os.environ.setdefault('TF_NUM_INTEROP_THREADS', '1')
+    os.environ.setdefault('OMP_NUM_THREADS', threads_per_worker)
+
+
+def post_worker_init(worker):
+    # Runs in the worker right before its accept loop, so a worker takes no connections (not even
+    # /readyz probes) until its own models are loaded and warm.
+    import app
+    loaded = threading.Event()
+
+    def heartbeat():
+        # loading and warming up can outlast `timeout`; keep the master from killing the worker meanwhile
+        while not loaded.wait(timeout / 4.0):
+            worker.notify()
+
+    threading.Thread(target=heartbeat, name='load-heartbeat', daemon=True).start()
+    try:
+        app.load_models()
+        app.warmup()
+    finally:
+        loaded.set()
+    app.jobs.start()
@@ -62,10 +62,17 @@ class PassageTagger(object):
         self.tokenizer = Tokenizer(token_dict)    
     
     def make_data(self, trainfilename, maxseqlen=None, maxclauselen=None, label_ind=None, train=False):
+        str_seqs, label_seqs = read_passages(trainfilename, is_labeled=train)
+        return self.make_data_from_sequences(str_seqs, label_seqs, maxseqlen=maxseqlen, maxclauselen=maxclauselen,
+                                             label_ind=label_ind, train=train)
+
+    def make_data_from_sequences(self, str_seqs, label_seqs=None, maxseqlen=None, maxclauselen=None, label_ind=None, train=False):
+        # str_seqs is a list of passages, each a list of clauses; label_seqs is only needed for training
         use_attention = self.params["use_attention"]
         batch_size = self.params["batch_size"]
 
-        str_seqs, label_seqs = read_passages(trainfilename, is_labeled=train)
+        if label_seqs is None:
+            label_seqs = [[] for _ in str_seqs]
         print(str_seqs)
         str_seqs = clean_words(str_seqs)
         label_seqs = to_BIO(label_seqs)
@@ -66,22 +66,6 @@ class TensorAttention(Layer):
                                 initializer=self.init,trainable=True)
             self.bias = self.add_weight(shape=(self.rec_hid_dim * 4,),name='bias',
                                         initializer=self.init,trainable=True)
-            self.kernel_i = self.kernel[:, :self.rec_hid_dim]
-            self.kernel_f = self.kernel[:, self.rec_hid_dim: self.rec_hid_dim * 2]
-            self.kernel_c = self.kernel[:, self.rec_hid_dim * 2: self.rec_hid_dim * 3]
-            self.kernel_o = self.kernel[:, self.rec_hid_dim * 3:]
-
-            self.recurrent_kernel_i = self.recurrent_kernel[:, :self.rec_hid_dim]
-            self.recurrent_kernel_f = (
-                self.recurrent_kernel[:, self.rec_hid_dim: self.rec_hid_dim * 2])
-            self.recurrent_kernel_c = (
-                self.recurrent_kernel[:, self.rec_hid_dim * 2: self.rec_hid_dim * 3])
-            self.recurrent_kernel_o = self.recurrent_kernel[:, self.rec_hid_dim * 3:]
-
-            self.bias_i = self.bias[:self.rec_hid_dim]
-            self.bias_f = self.bias[self.rec_hid_dim: self.rec_hid_dim * 2]
-            self.bias_c = self.bias[self.rec_hid_dim * 2: self.rec_hid_dim * 3]
-            self.bias_o = self.bias[self.rec_hid_dim * 3:]
 
         elif self.context == 'biLSTM_clause':
             self.att_scorer = self.add_weight(name='att_scorer',shape=(self.rec_hid_dim*2,),initializer=self.init, trainable=True)
@@ -92,22 +76,6 @@ class TensorAttention(Layer):
                                 initializer=self.init,trainable=True)
             self.bias_forward = self.add_weight(shape=(self.rec_hid_dim * 4,),name='bias_forward',
                                         initializer=self.init,trainable=True)
-            self.kernel_i_forward = self.kernel_forward[:, :self.rec_hid_dim]
-            self.kernel_f_forward = self.kernel_forward[:, self.rec_hid_dim: self.rec_hid_dim * 2]
-            self.kernel_c_forward = self.kernel_forward[:, self.rec_hid_dim * 2: self.rec_hid_dim * 3]
-            self.kernel_o_forward = self.kernel_forward[:, self.rec_hid_dim * 3:]
-
-            self.recurrent_kernel_i_forward = self.recurrent_kernel_forward[:, :self.rec_hid_dim]
-            self.recurrent_kernel_f_forward = (
-                self.recurrent_kernel_forward[:, self.rec_hid_dim: self.rec_hid_dim * 2])
-            self.recurrent_kernel_c_forward = (
-                self.recurrent_kernel_forward[:, self.rec_hid_dim * 2: self.rec_hid_dim * 3])
-            self.recurrent_kernel_o_forward = self.recurrent_kernel_forward[:, self.rec_hid_dim * 3:]
-
-            self.bias_i_forward = self.bias_forward[:self.rec_hid_dim]
-            self.bias_f_forward = self.bias_forward[self.rec_hid_dim: self.rec_hid_dim * 2]
-            self.bias_c_forward = self.bias_forward[self.rec_hid_dim * 2: self.rec_hid_dim * 3]
-            self.bias_o_forward = self.bias_forward[self.rec_hid_dim * 3:]
 
             self.kernel_backward = self.add_weight(shape=(self.proj_dim, self.rec_hid_dim * 4),
                                 name='kernel_backward',initializer=self.init,trainable=True)
@@ -116,22 +84,6 @@ class TensorAttention(Layer):
                                 initializer=self.init,trainable=True)
             self.bias_backward = self.add_weight(shape=(self.rec_hid_dim * 4,),name='bias_backward',
                                         initializer=self.init,trainable=True)
-            self.kernel_i_backward = self.kernel_backward[:, :self.rec_hid_dim]
-            self.kernel_f_backward = self.kernel_backward[:, self.rec_hid_dim: self.rec_hid_dim * 2]
-            self.kernel_c_backward = self.kernel_backward[:, self.rec_hid_dim * 2: self.rec_hid_dim * 3]
-            self.kernel_o_backward = self.kernel_backward[:, self.rec_hid_dim * 3:]
-
-            self.recurrent_kernel_i_backward = self.recurrent_kernel_backward[:, :self.rec_hid_dim]
-            self.recurrent_kernel_f_backward = (
-                self.recurrent_kernel_backward[:, self.rec_hid_dim: self.rec_hid_dim * 2])
-            self.recurrent_kernel_c_backward = (
-                self.recurrent_kernel_backward[:, self.rec_hid_dim * 2: self.rec_hid_dim * 3])
-            self.recurrent_kernel_o_backward = self.recurrent_kernel_backward[:, self.rec_hid_dim * 3:]
-
-            self.bias_i_backward = self.bias_backward[:self.rec_hid_dim]
-            self.bias_f_backward = self.bias_backward[self.rec_hid_dim: self.rec_hid_dim * 2]
-            self.bias_c_backward = self.bias_backward[self.rec_hid_dim * 2: self.rec_hid_dim * 3]
-            self.bias_o_backward = self.bias_backward[self.rec_hid_dim * 3:]
 
         elif self.context == 'para':
             self.att_scorer = self.add_weight(name='att_scorer',shape=(self.td1, self.td2, self.proj_dim),
@@ -156,6 +108,27 @@ class TensorAttention(Layer):
         else:
             return None
 
+    def lstm(self, inputs, initial_state, kernel, recurrent_kernel, bias):
+        '''
+        LSTM over the word axis of inputs (sample,w,c,p) with gates packed as i,f,c,o.
+        The input projection of every timestep is one matmul up front, so each step
+        is a single recurrent matmul whose result is split into the four gates.
+        '''
+        r = self.rec_hid_dim
+        input_proj = K.bias_add(tf.tensordot(inputs, kernel, axes=[[3],[0]]), bias) # (sample,w,c,4r)
+        def step(x, states):
+            h_tm1 = states[0]  # previous memory state
+            c_tm1 = states[1]  # previous carry state
+            z = x + tf.tensordot(h_tm1, recurrent_kernel, axes=[[2],[0]])
+            i = activations.hard_sigmoid(z[:, :, :r])
+            f = activations.hard_sigmoid(z[:, :, r: 2 * r])
+            c = f * c_tm1 + i * activations.tanh(z[:, :, 2 * r: 3 * r])
+            o = activations.hard_sigmoid(z[:, :, 3 * r:])
+            h = o * activations.tanh(c)
+            return h, [h, c]
+        _,all_rnn_out,_ = K.rnn(step,input_proj,[initial_state,initial_state])
+        return all_rnn_out
+
     def call(self, X, mask=None):
         # input: D (sample,c,w,d)
         proj_input = self.activation(tf.tensordot(X, self.att_proj, axes=[[3],[0]])) # tanh(dot(D,P))=Dl,（sample,c,w,p）
@@ -195,92 +168,23 @@ class TensorAttention(Layer):
                                                 self.att_scorer, axes=[[3],[0]])
 
         elif self.context == 'LSTM_clause':
-            def step(inputs, states):
-                h_tm1 = states[0]  # previous memory state
-                c_tm1 = states[1]  # previous carry state
-
-                x_i = tf.tensordot(inputs, self.kernel_i,axes=[[2],[0]])
-                x_f = tf.tensordot(inputs, self.kernel_f,axes=[[2],[0]])
-                x_c = tf.tensordot(inputs, self.kernel_c,axes=[[2],[0]])
-                x_o = tf.tensordot(inputs, self.kernel_o,axes=[[2],[0]])
-                x_i = K.bias_add(x_i, self.bias_i)
-                x_f = K.bias_add(x_f, self.bias_f)
-                x_c = K.bias_add(x_c, self.bias_c)
-                x_o = K.bias_add(x_o, self.bias_o)
-                i = activations.hard_sigmoid(x_i + tf.tensordot(h_tm1,
-                                                          self.recurrent_kernel_i,axes=[[2],[0]]))
-                f = activations.hard_sigmoid(x_f + tf.tensordot(h_tm1,
-                                                          self.recurrent_kernel_f,axes=[[2],[0]]))
-                c = f * c_tm1 + i * activations.tanh(x_c + tf.tensordot(h_tm1,
-                                                                self.recurrent_kernel_c,axes=[[2],[0]]))
-                o = activations.hard_sigmoid(x_o + tf.tensordot(h_tm1,
-                                                          self.recurrent_kernel_o,axes=[[2],[0]]))
-                h = o * activations.tanh(c)
-
-                return h, [h, c]
             # Make all-zero initial state. 
             # Directly obtaining the first input dimension is not allowed, so this is the work-aronud.
             initial_state = tf.tensordot(K.max(proj_input*0,axis=2),K.zeros((self.proj_dim, self.rec_hid_dim)), axes = [[2],[0]])
             proj_input_permute = K.permute_dimensions(proj_input,(0,2,1,3))
-            _,all_rnn_out,_ = K.rnn(step,proj_input_permute,[initial_state,initial_state])
+            all_rnn_out = self.lstm(proj_input_permute, initial_state, self.kernel, self.recurrent_kernel, self.bias)
             raw_att_scores = tf.tensordot(K.permute_dimensions(all_rnn_out,(0,2,1,3)), 
                                                 self.att_scorer, axes=[[3],[0]])
         elif self.context == 'biLSTM_clause':
-            def step_forward(inputs, states):
-                h_tm1 = states[0]  # previous memory state
-                c_tm1 = states[1]  # previous carry state
-
-                x_i = tf.tensordot(inputs, self.kernel_i_forward,axes=[[2],[0]])
-                x_f = tf.tensordot(inputs, self.kernel_f_forward,axes=[[2],[0]])
-                x_c = tf.tensordot(inputs, self.kernel_c_forward,axes=[[2],[0]])
-                x_o = tf.tensordot(inputs, self.kernel_o_forward,axes=[[2],[0]])
-                x_i = K.bias_add(x_i, self.bias_i_forward)
-                x_f = K.bias_add(x_f, self.bias_f_forward)
-                x_c = K.bias_add(x_c, self.bias_c_forward)
-                x_o = K.bias_add(x_o, self.bias_o_forward)
-                i = activations.hard_sigmoid(x_i + tf.tensordot(h_tm1,
-                                                          self.recurrent_kernel_i_forward,axes=[[2],[0]]))
-                f = activations.hard_sigmoid(x_f + tf.tensordot(h_tm1,
-                                                          self.recurrent_kernel_f_forward,axes=[[2],[0]]))
-                c = f * c_tm1 + i * activations.tanh(x_c + tf.tensordot(h_tm1,
-                                                                self.recurrent_kernel_c_forward,axes=[[2],[0]]))
-                o = activations.hard_sigmoid(x_o + tf.tensordot(h_tm1,
-                                                          self.recurrent_kernel_o_forward,axes=[[2],[0]]))
-                h = o * activations.tanh(c)
-
-                return h, [h, c]
-
-            def step_backward(inputs, states):
-                h_tm1 = states[0]  # previous memory state
-                c_tm1 = states[1]  # previous carry state
-
-                x_i = tf.tensordot(inputs, self.kernel_i_backward,axes=[[2],[0]])
-                x_f = tf.tensordot(inputs, self.kernel_f_backward,axes=[[2],[0]])
-                x_c = tf.tensordot(inputs, self.kernel_c_backward,axes=[[2],[0]])
-                x_o = tf.tensordot(inputs, self.kernel_o_backward,axes=[[2],[0]])
-                x_i = K.bias_add(x_i, self.bias_i_backward)
-                x_f = K.bias_add(x_f, self.bias_f_backward)
-                x_c = K.bias_add(x_c, self.bias_c_backward)
-                x_o = K.bias_add(x_o, self.bias_o_backward)
-                i = activations.hard_sigmoid(x_i + tf.tensordot(h_tm1,
-                                                          self.recurrent_kernel_i_backward,axes=[[2],[0]]))
-                f = activations.hard_sigmoid(x_f + tf.tensordot(h_tm1,
-                                                          self.recurrent_kernel_f_backward,axes=[[2],[0]]))
-                c = f * c_tm1 + i * activations.tanh(x_c + tf.tensordot(h_tm1,
-                                                                self.recurrent_kernel_c_backward,axes=[[2],[0]]))
-                o = activations.hard_sigmoid(x_o + tf.tensordot(h_tm1,
-                                                          self.recurrent_kernel_o_backward,axes=[[2],[0]]))
-                h = o * activations.tanh(c)
-
-                return h, [h, c]
-
             # Make all-zero initial state. 
             # Directly obtaining the first input dimension is not allowed, so this is the work-aronud.
             initial_state = tf.tensordot(K.max(proj_input*0,axis=2),K.zeros((self.proj_dim, self.rec_hid_dim)), axes = [[2],[0]])
             proj_input_permute = K.permute_dimensions(proj_input,(0,2,1,3))
             proj_input_permute_backward = K.reverse(proj_input_permute, 1)
-            _,all_rnn_out_forward,_ = K.rnn(step_forward,proj_input_permute,[initial_state,initial_state])
-            _,all_rnn_out_backward,_ = K.rnn(step_backward,proj_input_permute_backward,[initial_state,initial_state])
+            all_rnn_out_forward = self.lstm(proj_input_permute, initial_state,
+                                            self.kernel_forward, self.recurrent_kernel_forward, self.bias_forward)
+            all_rnn_out_backward = self.lstm(proj_input_permute_backward, initial_state,
+                                             self.kernel_backward, self.recurrent_kernel_backward, self.bias_backward)
             all_rnn_out = K.concatenate([all_rnn_out_forward,all_rnn_out_backward],axis=-1)
             raw_att_scores = tf.tensordot(K.permute_dimensions(all_rnn_out,(0,2,1,3)), 
                                                 self.att_scorer, axes=[[3],[0]])
@@ -312,4 +216,3 @@ class TensorAttention(Layer):
                 'hard_k': self.k,
                 'context': self.context,
                 'trainable': True}
-
@@ -0,0 +1,83 @@
+import threading
+import time
+from concurrent.futures import Future
+from queue import Queue, Empty
+
+from .process_local import ProcessLocal
+
+
+class MicroBatcher(object):
+    '''Coalesce passages from concurrent callers into shared tagger batches.
+
+    Callers hand over their (already segmented) passages and block on a future.
+    A single worker thread waits up to `max_wait_ms` for more work, or until
+    `max_sentences` sentences are queued, runs one encoder and tagger pass over
+    everything it collected and scatters the results back to each caller.
+    '''
+
+    def __init__(self, extractor, max_wait_ms=10, max_sentences=300):
+        self.extractor = extractor
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_sentences = max_sentences
+        self.num_batches = 0
+        self.num_requests = 0
+        self._lock = threading.Lock()
+        self._queue = ProcessLocal(Queue)
+        self._worker = None
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+                self._worker.start()
+            return self._queue.get()
+
+    def _collect(self, queue):
+        batch = [queue.get()]
+        num_sentences = sum(len(doc) for doc in batch[0][0])
+        deadline = time.monotonic() + self.max_wait
+        while num_sentences < self.max_sentences:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = queue.get(timeout=timeout)
+            except Empty:
+                break
+            batch.append(item)
+            num_sentences += sum(len(doc) for doc in item[0])
+        return batch
+
+    def _run(self):
+        queue = self._queue.get()
+        while True:
+            batch = self._collect(queue)
+            passages = [doc for docs, _ in batch for doc in docs]
+            try:
+                results = self.extractor._tag_passages(passages)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.num_batches += 1
+            self.num_requests += len(batch)
+            start = 0
+            for docs, future in batch:
+                future.set_result(results[start:start + len(docs)])
+                start += len(docs)
+
+    def tag_passages(self, passages):
+        '''Same contract as `HighlightExtractor._tag_passages`, but shared with other callers.'''
+        if len(passages) == 0:
+            return []
+        future = Future()
+        self._ensure_worker().put((passages, future))
+        return future.result()
+
+    def tag(self, text_or_path, from_file=False, parsed=True, lazy_tense=False):
+        return self.extractor.tag(text_or_path, from_file=from_file, parsed=parsed,
+                                  tag_passages=self.tag_passages, lazy_tense=lazy_tense)
+
+    def tag_windows(self, windows, parsed=False, lazy_tense=False):
+        return self.extractor.tag_windows(windows, parsed=parsed, tag_passages=self.tag_passages,
+                                          lazy_tense=lazy_tense)
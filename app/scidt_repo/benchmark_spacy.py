@@ -0,0 +1,88 @@
+"""
+Compare the old full spaCy pipeline against the trimmed pipelines in segmentation: how
+often they split a paper into the same sentences and give its sentences the same tense, and
+their throughput (docs/sec) for segmentation alone and for segmentation plus tense.
+
+    python -m scidt_repo.benchmark_spacy --input_path papers/ --n_process 2
+"""
+import argparse
+import time
+from glob import glob
+
+import spacy
+
+from .segmentation import get_nlp, segment_many, root_tense
+
+
+def full_pipeline():
+    # what extract_highlights used to load at import time
+    nlp = spacy.load("en_core_web_sm")
+    nlp.add_pipe("sentencizer", config={"punct_chars": None})
+    return nlp
+
+
+def before(nlp, texts, tense):
+    for text in texts:
+        sents = [str(sent) for sent in nlp(text).sents]
+        if tense:
+            [root_tense(nlp(s)) for s in sents]
+
+
+def after(texts, tense, batch_size, n_process):
+    for sents in segment_many(texts, tense=tense, batch_size=batch_size, n_process=n_process):
+        if tense:
+            [root_tense(sent) for sent in sents]
+
+
+def agreement(nlp, texts, batch_size):
+    """Papers split into exactly the same sentences, and sentences given the same tense, old vs new."""
+    same_docs = same_tenses = num_sents = 0
+    for text, sents in zip(texts, segment_many(texts, tense=True, batch_size=batch_size)):
+        old_sents = [str(sent) for sent in nlp(text).sents]
+        if old_sents == [str(sent) for sent in sents]:
+            same_docs += 1
+            # the old code parsed every sentence again on its own to read its tense
+            same_tenses += sum(root_tense(nlp(old)) == root_tense(new) for old, new in zip(old_sents, sents))
+            num_sents += len(sents)
+    return same_docs, same_tenses, num_sents
+
+
+def docs_per_sec(run, num_docs):
+    start = time.perf_counter()
+    run()
+    return num_docs / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description="Benchmark spaCy segmentation and tense detection")
+    argparser.add_argument('--input_path', type=str, help="Directory of plain text papers, one per file")
+    argparser.add_argument('--repeat', type=int, help="Number of passes over the papers")
+    argparser.set_defaults(repeat=1)
+    argparser.add_argument('--batch_size', type=int, help="nlp.pipe batch size")
+    argparser.set_defaults(batch_size=64)
+    argparser.add_argument('--n_process', type=int, help="nlp.pipe worker processes")
+    argparser.set_defaults(n_process=1)
+    args = argparser.parse_args()
+
+    texts = []
+    for path in sorted(glob(args.input_path.rstrip("/") + "/*")):
+        with open(path) as f:
+            texts.append(f.read().replace('\n', ' '))
+    texts = texts * args.repeat
+    print("Documents:", len(texts))
+
+    nlp = full_pipeline()
+    # load the trimmed pipelines up front so neither side pays model loading inside the timer
+    get_nlp(tense=False)
+    get_nlp(tense=True)
+    same_docs, same_tenses, num_sents = agreement(nlp, texts, args.batch_size)
+    segmented_alike = [[str(sent) for sent in sents] for sents in segment_many(texts, batch_size=args.batch_size)] == \
+        [[str(sent) for sent in sents] for sents in segment_many(texts, tense=True, batch_size=args.batch_size)]
+    print("Same sentences as before: %d/%d papers; same tense: %d/%d of their sentences" % (
+        same_docs, len(texts), same_tenses, num_sents))
+    print("Segmentation and tense pipelines split alike:", segmented_alike)
+    for tense in (False, True):
+        task = "segmentation + tense" if tense else "segmentation"
+        old = docs_per_sec(lambda: before(nlp, texts, tense), len(texts))
+        new = docs_per_sec(lambda: after(texts, tense, args.batch_size, args.n_process), len(texts))
+        print("%-22s before: %8.2f docs/sec   after: %8.2f docs/sec   (x%.1f)" % (task, old, new, new / old))
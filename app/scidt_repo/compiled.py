@@ -0,0 +1,102 @@
+import numpy as np
+import tensorflow as tf
+
+
+def length_buckets(max_length, smallest=16):
+    '''Powers of two from `smallest` up to `max_length`, which is always the last bucket.'''
+    buckets = []
+    length = smallest
+    while length < max_length:
+        buckets.append(length)
+        length *= 2
+    return buckets + [max_length]
+
+
+class CompiledModel(object):
+    '''Call a Keras model through a few pre-traced `tf.function`s instead of `predict`.
+
+    Every call is padded along the time axis (axis 1 of every input) up to the next of
+    `length_buckets`, so only one graph per bucket is ever traced; the batch axis is left
+    dynamic in each signature, so any batch size reuses it. Padding is all zeros, which the
+    encoder and the masked sentence tagger both ignore, and is sliced off the outputs again.
+    Models with a fixed time axis get a single signature. `pad_side='left'` matches the
+    left-padded passages of the tagger. Anything else (`inputs`, `layers`, ...) is looked up
+    on the wrapped model, so this can stand in for it in the generator and `PassageTagger`.
+    '''
+
+    def __init__(self, model, length_buckets=None, pad_side='right'):
+        self.model = model
+        self.pad_side = pad_side
+        self.input_specs = [(tuple(tensor.shape)[2:], tf.as_dtype(tensor.dtype)) for tensor in model.inputs]
+        self.fixed_length = model.inputs[0].shape[1]
+        if self.fixed_length is not None or not length_buckets:
+            self.length_buckets = []
+        else:
+            self.length_buckets = sorted(length_buckets)
+        self._functions = {}
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def padded_length(self, length):
+        '''The time-axis length a call with inputs of `length` steps really runs at.'''
+        if self.fixed_length is not None:
+            return self.fixed_length
+        for bucket in self.length_buckets:
+            if length <= bucket:
+                return bucket
+        # longer than every bucket: trace this exact length
+        return length
+
+    def _function(self, length):
+        if length not in self._functions:
+            signature = [tf.TensorSpec((None, length) + shape, dtype) for shape, dtype in self.input_specs]
+            model = self.model
+
+            @tf.function(input_signature=signature)
+            def run(*inputs):
+                return model(list(inputs) if len(inputs) > 1 else inputs[0], training=False)
+            self._functions[length] = run
+        return self._functions[length]
+
+    def _pad(self, x, length):
+        padding = [(0, 0)] * x.ndim
+        padding[1] = (length - x.shape[1], 0) if self.pad_side == 'left' else (0, length - x.shape[1])
+        return np.pad(x, padding)
+
+    def _unpad(self, y, length, padded_length):
+        if y.ndim < 3 or y.shape[1] != padded_length or length == padded_length:
+            return y
+        return y[:, -length:] if self.pad_side == 'left' else y[:, :length]
+
+    def predict_on_batch(self, x):
+        inputs = [np.asarray(i, dtype=dtype.as_numpy_dtype)
+                  for i, (_, dtype) in zip(x if isinstance(x, (list, tuple)) else [x], self.input_specs)]
+        length = inputs[0].shape[1]
+        padded_length = self.padded_length(length)
+        if padded_length != length:
+            inputs = [self._pad(i, padded_length) for i in inputs]
+        outputs = self._function(padded_length)(*inputs)
+        if isinstance(outputs, (list, tuple)):
+            return [self._unpad(np.asarray(y), length, padded_length) for y in outputs]
+        return self._unpad(np.asarray(outputs), length, padded_length)
+
+    def predict(self, x, batch_size=64):
+        inputs = x if isinstance(x, (list, tuple)) else [x]
+        if len(inputs[0]) <= batch_size:
+            return self.predict_on_batch(x)
+        chunks = [self.predict_on_batch([i[start:start + batch_size] for i in inputs] if len(inputs) > 1
+                                        else inputs[0][start:start + batch_size])
+                  for start in range(0, len(inputs[0]), batch_size)]
+        if isinstance(chunks[0], list):
+            return [np.concatenate(outputs) for outputs in zip(*chunks)]
+        return np.concatenate(chunks)
+
+    def warmup(self, batch_size=1):
+        '''Trace the function of every bucket now rather than on the first request that needs it.'''
+        for length in self.length_buckets or [self.fixed_length]:
+            if length is None:
+                # no buckets for a free time axis; it is traced per length on first use
+                break
+            self.predict_on_batch([np.zeros((batch_size, length) + shape, dtype=dtype.as_numpy_dtype)
+                                   for shape, dtype in self.input_specs])
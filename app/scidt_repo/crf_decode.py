@@ -0,0 +1,131 @@
+import numpy as np
+
+from .numpy_tagger import ACTIVATIONS
+
+
+def _logsumexp(x, axis):
+    m = np.max(x, axis=axis, keepdims=True)
+    return np.squeeze(m, axis) + np.log(np.sum(np.exp(x - m), axis=axis))
+
+
+def _shift_right(x):
+    # one step later along the time axis, as `CRF.shift_right`
+    return np.concatenate([np.zeros_like(x[:, :1]), x[:, :-1]], axis=1)
+
+
+def _shift_left(x):
+    return np.concatenate([x[:, 1:], np.zeros_like(x[:, :1])], axis=1)
+
+
+class CRFDecoder(object):
+    '''The test-time outputs of a trained `CRF` layer, `viterbi_decoding` and `get_marginal_prob`, in NumPy.
+
+    Per-step label energies are u_t = activation(x_t W + bias), and the chain energy of moving
+    from label i to label j is U[i, j], where W, U and bias are `kernel`, `chain_kernel` and
+    `bias`. `left_boundary` and `right_boundary` are added where the layer adds them (see
+    `input_energy`). The recursions follow `CRF.recursion` step by step, so a passage gets the
+    labels and probabilities the Keras model would have given it, including with no mask, when
+    the layer runs over the whole left-padded sequence. Inputs are what the CRF layer receives,
+    shaped (batch, time, features); `mask` (batch, time) is the mask the layer receives, None
+    for taggers without a Masking layer. Everything is vectorized over the batch.
+    '''
+
+    def __init__(self, kernel, chain_kernel, bias=None, left_boundary=None, right_boundary=None,
+                 activation='linear'):
+        if activation not in ACTIVATIONS:
+            raise ValueError("Unsupported CRF activation: %s" % activation)
+        self.kernel = np.asarray(kernel, dtype=np.float64)
+        self.chain_kernel = np.asarray(chain_kernel, dtype=np.float64)
+        self.bias = None if bias is None else np.asarray(bias, dtype=np.float64)
+        self.left_boundary = None if left_boundary is None else np.asarray(left_boundary, dtype=np.float64)
+        self.right_boundary = None if right_boundary is None else np.asarray(right_boundary, dtype=np.float64)
+        self.activation = ACTIVATIONS[activation]
+        self.units = self.chain_kernel.shape[0]
+
+    @classmethod
+    def from_layer(cls, crf):
+        # weights come back in the order `CRF.build` adds them
+        weights = list(crf.get_weights())
+        kernel, chain_kernel = weights[:2]
+        rest = weights[2:]
+        bias = rest.pop(0) if crf.use_bias else None
+        left_boundary, right_boundary = rest if crf.use_boundary else (None, None)
+        return cls(kernel, chain_kernel, bias, left_boundary, right_boundary,
+                   activation=crf.get_config()['activation'])
+
+    def input_energy(self, X, mask=None):
+        '''Per-step label energies, with the boundary energies added like `CRF.add_boundary_energy`.
+
+        Without a mask they go on the first and last step of the padded sequence. With one, the
+        start energy goes where the mask rises and the end energy where it falls, at
+        `shift_left(mask) > mask`. For a left-padded passage that is the padding step just before
+        it, which the recursions mask out, so only unmasked taggers ever use the end energy.
+        '''
+        energy = np.dot(X, self.kernel)
+        if self.bias is not None:
+            energy = energy + self.bias
+        energy = self.activation(energy)
+        if self.left_boundary is not None:
+            if mask is None:
+                energy = energy.copy()
+                energy[:, 0] += self.left_boundary
+                energy[:, -1] += self.right_boundary
+            else:
+                mask = np.asarray(mask, dtype=np.float64)
+                start = mask > _shift_right(mask)
+                end = _shift_left(mask) > mask
+                energy = energy + start[:, :, None] * self.left_boundary + end[:, :, None] * self.right_boundary
+        return energy
+
+    def _recursion(self, energy, mask, go_backwards=False, viterbi=False):
+        '''`CRF.recursion`: log-sum-exp messages, or Viterbi argmin tables, for every step.
+
+        The chain energy of step t links it to step t + 1, and is kept only where both are real,
+        so with a mask the last step has none; without one every step, the last included, has
+        it. Going backwards, the layer reverses the steps but not `chain_kernel`.
+        '''
+        batch, steps, units = energy.shape
+        keep = np.ones((batch, steps)) if mask is None else np.asarray(mask, dtype=np.float64)
+        if go_backwards:
+            energy, keep = energy[:, ::-1], keep[:, ::-1]
+        link = np.ones((batch, steps)) if mask is None else keep * _shift_left(keep)
+        outputs = np.zeros((batch, steps, units), dtype=int if viterbi else np.float64)
+        previous = np.zeros((batch, units))
+        for t in range(steps):
+            chain = self.chain_kernel[None] * link[:, t, None, None]  # (batch, label t, label t + 1)
+            energy_t = energy[:, t] * keep[:, t, None]
+            if viterbi:
+                scores = chain + (energy_t + previous)[:, :, None]
+                outputs[:, t] = np.argmin(scores, axis=1)
+                previous = np.min(scores, axis=1)
+            else:
+                previous = _logsumexp(-(chain + (energy_t - previous)[:, :, None]), axis=1)
+                outputs[:, t] = previous
+        return outputs[:, ::-1] if go_backwards else outputs
+
+    def viterbi(self, X, mask=None):
+        '''Label path of every sequence, shaped (batch, time): the argmax of `CRF.viterbi_decoding`.'''
+        tables = self._recursion(self.input_energy(X, mask), mask, viterbi=True)
+        batch, steps, _ = tables.shape
+        rows = np.arange(batch)
+        # like the layer, start from the last table's entry for label 0 and walk back
+        best = tables[:, -1, 0]
+        paths = np.zeros((batch, steps), dtype=int)
+        for t in range(steps - 1, -1, -1):
+            best = tables[rows, t, best]
+            paths[:, t] = best
+        return paths
+
+    def marginals(self, X, mask=None):
+        '''Label probabilities of every step, shaped (batch, time, labels), as `CRF.get_marginal_prob` gives them.'''
+        energy = self.input_energy(X, mask)
+        alpha = self._recursion(energy, mask)
+        beta = self._recursion(energy, mask, go_backwards=True)
+        if mask is not None:
+            energy = energy * np.asarray(mask, dtype=np.float64)[:, :, None]
+        margin = -(_shift_right(alpha) + energy + _shift_left(beta))
+        margin = np.exp(margin - np.max(margin, axis=-1, keepdims=True))
+        return margin / np.sum(margin, axis=-1, keepdims=True)
+
+    def decode(self, X, mask=None):
+        return self.viterbi(X, mask), self.marginals(X, mask)
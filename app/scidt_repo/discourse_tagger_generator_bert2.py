@@ -22,14 +22,17 @@ import tensorflow as tf
 # from keras.activations import softmax
 from tensorflow.keras.regularizers import l2
 from tensorflow.keras.models import Model, model_from_json
-from tensorflow.keras.layers import Input, LSTM, Dense, Dropout, TimeDistributed, Bidirectional
+from tensorflow.keras.layers import Input, LSTM, Dense, Dropout, TimeDistributed, Bidirectional, Lambda, Masking
 from tensorflow.keras.callbacks import EarlyStopping,LearningRateScheduler, ModelCheckpoint
 from tensorflow.keras.optimizers import Adam, RMSprop, SGD
 from .crf import CRF
 from .attention import TensorAttention
 from .custom_layers import HigherOrderTimeDistributedDense
-from .generator import BertDiscourseGenerator
-from keras_bert import load_trained_model_from_checkpoint, Tokenizer
+from .generator import BertDiscourseGenerator, CachedDiscourseGenerator, TokenizedClauses
+from .feature_store import FeatureStore
+from .embedding_cache import model_fingerprint
+from keras_bert import load_trained_model_from_checkpoint
+from .wordpiece import FastTokenizer
 
 
 def reset_random_seed(seed):
@@ -37,6 +40,51 @@ def reset_random_seed(seed):
     tf.random.set_seed(seed)
     np.random.seed(seed)
 
+def tagger_config_json(tagger, maxseqlen):
+    """The tagger's `to_json()` plus the number of clauses per passage it was trained on, which
+    the input shape of a variable-length tagger doesn't record."""
+    config = json.loads(tagger.to_json())
+    config["maxseqlen"] = int(maxseqlen)
+    return json.dumps(config)
+
+def load_tagger(config_json, weights_file_name, variable_length=False):
+    """Rebuild a saved tagger and load its weights.
+
+    Returns the model and the number of clauses per passage it was trained on, from its input
+    shape or, for a variable-length tagger, from the config (see `tagger_config_json`); None
+    for variable-length taggers saved before the config recorded it. With `variable_length`, a fixed-length
+    sentence tagger is rebuilt with a `None` time dimension and a Masking layer in front,
+    so batches only need padding to their longest passage. Masking has no weights, so the
+    existing checkpoint loads unchanged, but a tagger trained without masking learned to
+    read the left padding as zero rows: skipping it instead changes its predictions, so
+    only ask for this after checking the outputs still match. Taggers trained with
+    `--variable_length` already have their Masking layer and are loaded as saved.
+    """
+    config = json.loads(config_json)
+    trained_seqlen = config.pop("maxseqlen", None)
+    layers = config["config"]["layers"]
+    input_layer = [layer for layer in layers if layer["class_name"] == "InputLayer"][0]
+    shape_key = "batch_input_shape" if "batch_input_shape" in input_layer["config"] else "batch_shape"
+    input_shape = input_layer["config"][shape_key]
+    saved_seqlen = input_shape[1] or trained_seqlen
+    has_masking = any(layer["class_name"] == "Masking" for layer in layers)
+    # Attention models also fix the clause length, and their attention layer needs both dimensions.
+    if variable_length and len(input_shape) == 3 and not has_masking:
+        input_shape[1] = None
+        input_name = input_layer["name"]
+        for layer in layers:
+            for node in layer["inbound_nodes"]:
+                for inbound in node:
+                    if inbound[0] == input_name:
+                        inbound[0] = "input_masking"
+        layers.insert(layers.index(input_layer) + 1,
+                      {"class_name": "Masking", "name": "input_masking",
+                       "config": {"name": "input_masking", "trainable": True, "dtype": "float32", "mask_value": 0.0},
+                       "inbound_nodes": [[[input_name, 0, 0, {}]]]})
+    tagger = model_from_json(json.dumps(config), custom_objects={"TensorAttention":TensorAttention, "HigherOrderTimeDistributedDense":HigherOrderTimeDistributedDense,"CRF":CRF})
+    tagger.load_weights(weights_file_name)
+    return tagger, saved_seqlen
+
 class PassageTagger(object):
     def __init__(self, params):
         self.params = params
@@ -44,27 +92,51 @@ class PassageTagger(object):
         self.tagger = None
         self.maxclauselen = None
         self.maxseqlen = None
+        self.embedding_cache = None
+        # encoder outputs of whole training files, extracted once instead of every epoch
+        self.feature_store = None
+        # inference only: project attention models' token states right after the encoder (see ClauseProjection)
+        self.clause_projection = None
         pretrained_path = self.params["repfile"]
         config_path = os.path.join(pretrained_path, 'bert_config.json')
         checkpoint_path = os.path.join(pretrained_path, 'bert_model.ckpt')
         vocab_path = os.path.join(pretrained_path, 'vocab.txt')
         
-        self.bert = load_trained_model_from_checkpoint(config_path, checkpoint_path)
+        # seq_len=None lets the generator pad each batch only as far as its longest clause
+        self.bert = load_trained_model_from_checkpoint(config_path, checkpoint_path, seq_len=None)
         #self.bert._make_predict_function() # Crucial step, otherwise TF will give error.
         #self.bert.Model.make_predict_function()
+        if self.params["use_attention"]:
+            self.encoder = self.bert
+        else:
+            # Without attention the tagger only reads the [CLS] state, so slice it inside the graph
+            # rather than copying [N, seq_len, 768] activations out of TensorFlow.
+            cls_output = Lambda(lambda x: x[:, 0, :], name="cls_output")(self.bert.output)
+            self.encoder = Model(inputs=self.bert.inputs, outputs=cls_output)
         
         token_dict = {}
         with codecs.open(vocab_path, 'r', 'utf8') as reader:
             for line in reader:
                 token = line.strip()
                 token_dict[token] = len(token_dict)
-        self.tokenizer = Tokenizer(token_dict)    
+        # same ids as keras_bert's Tokenizer, with a vocabulary trie and per-word memo for bulk jobs
+        self.tokenizer = FastTokenizer(token_dict)
     
     def make_data(self, trainfilename, maxseqlen=None, maxclauselen=None, label_ind=None, train=False):
+        str_seqs, label_seqs = read_passages(trainfilename, is_labeled=train)
+        return self.make_data_from_sequences(str_seqs, label_seqs, maxseqlen=maxseqlen, maxclauselen=maxclauselen,
+                                             label_ind=label_ind, train=train, source_file=trainfilename)
+
+    def make_data_from_sequences(self, str_seqs, label_seqs=None, maxseqlen=None, maxclauselen=None, label_ind=None, train=False,
+                                 source_file=None, use_embedding_cache=True, memoize_clauses=False):
+        # str_seqs is a list of passages, each a list of clauses; label_seqs is only needed for training
+        # use_embedding_cache=False keeps these clauses out of (and away from) the embedding cache
+        # memoize_clauses=True encodes each distinct clause once for all passages (see BertDiscourseGenerator)
         use_attention = self.params["use_attention"]
         batch_size = self.params["batch_size"]
 
-        str_seqs, label_seqs = read_passages(trainfilename, is_labeled=train)
+        if label_seqs is None:
+            label_seqs = [[] for _ in str_seqs]
         print("Filtering data")
         str_seqs = clean_words(str_seqs)
         label_seqs = to_BIO(label_seqs)
@@ -73,24 +145,25 @@ class PassageTagger(object):
         else:
             self.label_ind = label_ind
         seq_lengths = [len(seq) for seq in str_seqs]
+        # every clause is tokenized at most once, for the length statistics and the generator alike
+        tokenized = TokenizedClauses(self.tokenizer)
         if self.maxseqlen is None:
             if maxseqlen:
                 self.maxseqlen = maxseqlen
             elif self.params["maxseqlen"] is not None:
                 self.maxseqlen = self.params["maxseqlen"]
-            else:
+            elif train:
                 self.maxseqlen = max(seq_lengths)
+            else:
+                # the tagger's passage length, never that of the first passages it happens to tag
+                raise ValueError("maxseqlen is unknown: pass the number of clauses per passage the tagger was trained on")
         if self.maxclauselen is None:
             if maxclauselen:
                 self.maxclauselen = maxclauselen
             elif self.params["maxclauselen"] is not None:
                 self.maxclauselen = self.params["maxclauselen"]
             elif use_attention:
-                sentence_lens = []
-                for str_seq in str_seqs:
-                    for seq in str_seq:
-                        tokens = self.tokenizer.tokenize(seq.lower())
-                        sentence_lens.append(len(tokens))
+                sentence_lens = tokenized.lengths([seq for str_seq in str_seqs for seq in str_seq])
                 self.maxclauselen = np.round(np.mean(sentence_lens) + 3 * np.std(sentence_lens)).astype(int)
 
         if len(self.label_ind)<=1:
@@ -100,7 +173,21 @@ class PassageTagger(object):
                         # Add new labels with values 0,1,2,....
                         self.label_ind[label] = len(self.label_ind)
         self.rev_label_ind = {i: l for (l, i) in self.label_ind.items()}
-        discourse_generator = BertDiscourseGenerator(self.bert, self.tokenizer, str_seqs, label_seqs, self.label_ind, batch_size, use_attention, self.maxseqlen, self.maxclauselen, train)
+        variable_length = self.params["variable_length"] and not use_attention
+        discourse_generator = BertDiscourseGenerator(self.encoder, self.tokenizer, str_seqs, label_seqs, self.label_ind, batch_size, use_attention, self.maxseqlen, self.maxclauselen, train,
+                                                     max_clause_tokens=self.params["max_clause_tokens"], encoder_batch_size=self.params["encoder_batch_size"],
+                                                     embedding_cache=self.embedding_cache if use_embedding_cache else None,
+                                                     variable_length=variable_length, tokenized=tokenized,
+                                                     clause_projection=self.clause_projection,
+                                                     memoize_clauses=memoize_clauses)
+        if self.feature_store is not None and source_file is not None and self.clause_projection is None:
+            clauses = [clause for str_seq in str_seqs for clause in str_seq]
+            row_shape = (self.maxclauselen, self.input_size) if use_attention else (self.input_size,)
+            features = self.feature_store.features(source_file, clauses, discourse_generator.encode_clauses, row_shape,
+                                                   max_clause_tokens=discourse_generator.max_clause_tokens,
+                                                   maxclauselen=int(self.maxclauselen) if use_attention else None)
+            discourse_generator = CachedDiscourseGenerator(features, str_seqs, label_seqs, self.label_ind, batch_size, use_attention, self.maxseqlen, self.maxclauselen, train,
+                                                           variable_length=variable_length, max_clause_tokens=discourse_generator.max_clause_tokens)
         return seq_lengths, discourse_generator # One-hot representation of labels
 
     def predict(self, discourse_generator, test_seq_lengths=None, tagger=None):
@@ -110,8 +197,13 @@ class PassageTagger(object):
             assert(False)
         else:
             x_lens = test_seq_lengths
-        pred_probs = tagger.predict_generator(discourse_generator)
-        pred_inds = np.argmax(pred_probs, axis=2)
+        # Batches of a variable-length tagger differ in length, so predict them one at a time
+        # and keep one array per passage.
+        pred_probs = []
+        for i in range(len(discourse_generator)):
+            batch_X, _ = discourse_generator[i]
+            pred_probs.extend(np.asarray(tagger.predict_on_batch(batch_X)))
+        pred_inds = [np.argmax(probs, axis=-1) for probs in pred_probs]
         pred_label_seqs = []
         for pred_ind, x_len in zip(pred_inds, x_lens):
             pred_label_seq = [self.rev_label_ind[pred] for pred in pred_ind][-x_len:]
@@ -157,8 +249,14 @@ class PassageTagger(object):
             x, raw_attention = TensorAttention(att_input_shape, context=att_context, hard_k=hard_k, proj_dim = att_proj_dim, rec_hid_dim = rec_hid_dim, return_attention=True)(x)
             x = Dropout(attention_dropout)(x)
         else:
-            inputs = Input(shape=(self.maxseqlen, self.input_size))
-            x = Dropout(embedding_dropout)(inputs)
+            if self.params["variable_length"]:
+                # padded clauses are all-zero rows; masking keeps the LSTM (and CRF) from reading them
+                inputs = Input(shape=(None, self.input_size))
+                x = Masking(mask_value=0.)(inputs)
+            else:
+                inputs = Input(shape=(self.maxseqlen, self.input_size))
+                x = inputs
+            x = Dropout(embedding_dropout)(x)
             x = Dense(input_dim=self.input_size, units=word_proj_dim)(x)
         
         if bidirectional:
@@ -217,7 +315,7 @@ class PassageTagger(object):
             model_config_file = open("model_%s_config.json"%model_ext, "w")
             model_weights_file_name = "model_%s_weights"%model_ext
             model_label_ind = "model_%s_label_ind.json"%model_ext
-            print(self.tagger.to_json(), file=model_config_file)
+            print(tagger_config_json(self.tagger, self.maxseqlen), file=model_config_file)
             self.tagger.save_weights(model_weights_file_name, overwrite=True)
             json.dump(self.label_ind, open(model_label_ind, "w"))
         return f_mean, f_std, original_f_mean, original_f_std
@@ -267,6 +365,12 @@ if __name__ == "__main__":
     argparser.set_defaults(outpath="./")
     argparser.add_argument('--batch_size', help="batch size")
     argparser.set_defaults(batch_size=10)
+    argparser.add_argument('--max_clause_tokens', type=int, help="max number of wordpiece tokens per clause fed to SciBERT")
+    argparser.set_defaults(max_clause_tokens=512)
+    argparser.add_argument('--encoder_batch_size', type=int, help="number of length-bucketed clauses per SciBERT call")
+    argparser.set_defaults(encoder_batch_size=64)
+    argparser.add_argument('--variable_length', help="Sentence tagger input with a free (masked) number of clauses, padded per batch", action='store_true')
+    argparser.add_argument('--feature_store', type=str, help="Directory for SciBERT features of the train/validation/test files, extracted once and memory-mapped")
     
     args = argparser.parse_args()
     params = arg2param(args)
@@ -295,6 +399,8 @@ if __name__ == "__main__":
     if params["train"]:
         # First returned value is sequence lengths (without padding)
         nnt = PassageTagger(params)
+        if params["feature_store"]:
+            nnt.feature_store = FeatureStore(params["feature_store"], model_fingerprint(params["repfile"]))
         if params["repfile"]:
             print("Using BERT.")
             _, train_generator = nnt.make_data(params["train_file"], train=True)
@@ -313,16 +419,20 @@ if __name__ == "__main__":
             model_weights_file_name = "model_%s_weights"%model_ext
             model_label_ind = "model_%s_label_ind.json"%model_ext
             nnt = PassageTagger(params)
-            nnt.tagger = model_from_json(model_config_file.read(), custom_objects={"TensorAttention":TensorAttention, "HigherOrderTimeDistributedDense":HigherOrderTimeDistributedDense,"CRF":CRF})
+            if params["feature_store"]:
+                nnt.feature_store = FeatureStore(params["feature_store"], model_fingerprint(params["repfile"]))
+            nnt.tagger, saved_seqlen = load_tagger(model_config_file.read(), model_weights_file_name, variable_length=params["variable_length"])
             print("Loaded model:")
             print(nnt.tagger.summary())
-            nnt.tagger.load_weights(model_weights_file_name)
             print("Loaded weights")
             label_ind_json = json.load(open(model_label_ind))
             label_ind = {k: int(label_ind_json[k]) for k in label_ind_json}
             print("Loaded label index:", label_ind)
         if not params["use_attention"]:
-            params["maxseqlen"] = nnt.tagger.inputs[0].shape[1]
+            if params["train"]:
+                saved_seqlen = nnt.maxseqlen
+            # a variable-length tagger still caps passages at the length it was trained on
+            params["maxseqlen"] = saved_seqlen or params["maxseqlen"]
             params["maxclauselen"] = None
         else:
             for l in nnt.tagger.layers:
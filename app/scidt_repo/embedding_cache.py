@@ -0,0 +1,103 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from .process_local import ProcessLocal
+
+
+def model_fingerprint(pretrained_path):
+    '''Hash the encoder's config, vocabulary and checkpoint index, so cached vectors never outlive the model.'''
+    digest = hashlib.sha1()
+    for name in ('bert_config.json', 'vocab.txt', 'bert_model.ckpt.index'):
+        path = os.path.join(pretrained_path, name)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+
+class EmbeddingCache(object):
+    '''Sentence vector cache: an in-memory LRU tier in front of an optional sqlite file.
+
+    Entries are keyed by the model fingerprint plus a hash of the (cleaned, lowercased)
+    sentence, so one file can be shared by several models and by several processes.
+    '''
+
+    def __init__(self, fingerprint, capacity=10000, path=None):
+        self.fingerprint = fingerprint
+        self.capacity = capacity
+        self.path = path
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = ProcessLocal(self._open)
+
+    def _open(self):
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB)")
+        return db
+
+    def _connection(self):
+        return self._db.get()
+
+    def key(self, text):
+        return hashlib.sha1((self.fingerprint + '\0' + text).encode('utf8')).hexdigest()
+
+    def _remember(self, key, vector):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.capacity:
+            self._memory.popitem(last=False)
+
+    def get_many(self, texts):
+        '''Return the cached vector for every text, or None where there is none.'''
+        keys = [self.key(text) for text in texts]
+        vectors = [None] * len(keys)
+        with self._lock:
+            on_disk = []
+            for i, key in enumerate(keys):
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    vectors[i] = self._memory[key]
+                    self.hits += 1
+                else:
+                    on_disk.append(i)
+            if self.path is not None and on_disk:
+                db = self._connection()
+                for i in on_disk:
+                    row = db.execute("SELECT vector FROM embeddings WHERE key = ?", (keys[i],)).fetchone()
+                    if row is not None:
+                        vectors[i] = np.frombuffer(row[0], dtype=np.float32)
+                        self._remember(keys[i], vectors[i])
+                        self.hits += 1
+                        self.disk_hits += 1
+            self.misses += sum(vector is None for vector in vectors)
+        return vectors
+
+    def put_many(self, texts, vectors):
+        rows = []
+        with self._lock:
+            for text, vector in zip(texts, vectors):
+                key = self.key(text)
+                vector = np.asarray(vector, dtype=np.float32)
+                self._remember(key, vector)
+                rows.append((key, vector.tobytes()))
+            if self.path is not None and rows:
+                db = self._connection()
+                db.executemany("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", rows)
+                db.commit()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'size': len(self._memory)}
@@ -1,30 +1,84 @@
 import os
 import json
 import re
+from collections import deque
 
 # from .GRU_discourse_tagger_generator_bert import PassageTagger
-from .discourse_tagger_generator_bert2 import PassageTagger
+from .discourse_tagger_generator_bert2 import PassageTagger, load_tagger
 from .crf import CRF
 from .attention import TensorAttention
 from .custom_layers import HigherOrderTimeDistributedDense
+from .generator import ClauseProjection
+from .crf_decode import CRFDecoder
+from .numpy_tagger import NumpyTagger
+from .compiled import CompiledModel, length_buckets
 from .util import from_BIO
+from .embedding_cache import EmbeddingCache, model_fingerprint
+from .result_cache import ResultCache, weights_checksum
+from .segmentation import get_nlp, segment_many, root_tense, needs_tense_parse
 
-from tensorflow.keras.models import model_from_json
+from tensorflow.keras.models import Model
+from tensorflow.keras.layers import Input, Masking
 
 import pandas as pd
 import numpy as np
 
-import spacy
 
-nlp = spacy.load("en_core_web_sm")
-config = {"punct_chars": None}
-nlp.add_pipe("sentencizer", config=config)
+def sliding_windows(num_sentences, window_size, stride):
+    """(start, end) of overlapping windows covering every sentence; the last one ends at the document end."""
+    if num_sentences <= window_size:
+        return [(0, num_sentences)]
+    starts = list(range(0, num_sentences - window_size + 1, stride))
+    if starts[-1] + window_size < num_sentences:
+        starts.append(num_sentences - window_size)
+    return [(start, start + window_size) for start in starts]
+
+
+def stitch_windows(windows, window_probs, num_sentences, weighting='position'):
+    """Merge the label distributions of overlapping windows into one row per sentence.
+
+    With 'position' weighting a sentence counts more the further it is from its window's
+    edges, i.e. the more context it had on both sides; with 'confidence' each window's
+    prediction is weighted by its own top probability.
+    """
+    merged = np.zeros((num_sentences, window_probs[0].shape[-1]))
+    total = np.zeros(num_sentences)
+    for (start, end), probs in zip(windows, window_probs):
+        if weighting == 'confidence':
+            weights = np.max(probs, axis=-1)
+        elif weighting == 'position':
+            positions = np.arange(end - start)
+            weights = np.minimum(positions + 1, end - start - positions).astype(float)
+        else:
+            raise ValueError("Unknown window weighting: %s" % weighting)
+        merged[start:end] += weights[:, None] * probs
+        total[start:end] += weights
+    return merged / total[:, None]
+
+
+def layers_after(tagger, layer, input_shape, until=None):
+    """A model running the layers of a chained tagger that follow `layer` (up to, not including, `until`)
+    on inputs shaped like the output of `layer`. Shares the tagger's weights."""
+    inputs = Input(shape=input_shape)
+    x = inputs
+    for following in tagger.layers[tagger.layers.index(layer) + 1:]:
+        if following is until:
+            break
+        x = following(x)
+        if isinstance(x, list):
+            # TensorAttention also returns its attention scores
+            x = x[0]
+    return Model(inputs=inputs, outputs=x)
 
 
 class HighlightExtractor:
     # set all of the params needed for the PassageTagger
     def __init__(self, scibert_path, tagger_path, use_attention=False, att_context='LSTM_clause', lstm=False,
-                 bidirectional=False, crf=False, batch_size=10, maxseqlen=None, maxclauselen=None):
+                 bidirectional=False, crf=False, batch_size=10, maxseqlen=None, maxclauselen=None,
+                 max_clause_tokens=512, encoder_batch_size=64, embedding_cache_size=10000, embedding_cache_path=None,
+                 result_cache_backend=None, result_cache_ttl=None, spacy_batch_size=64, spacy_n_process=1,
+                 window_stride=None, window_weighting='position', variable_length=None, numpy_head=False,
+                 compiled=False, early_projection=True):
         self.scibert_path = scibert_path  # need to set for PassageTagger class
         self.tagger_path = tagger_path
         self.use_attention = use_attention
@@ -35,6 +89,16 @@ class HighlightExtractor:
         self.batch_size = batch_size
         self.maxseqlen = maxseqlen
         self.maxclauselen = maxclauselen
+        self.max_clause_tokens = max_clause_tokens
+        self.encoder_batch_size = encoder_batch_size
+        # Pad each batch only to its longest passage (sentence taggers only). That needs a Masking layer:
+        # checkpoints trained with one use it by default (None). `True` adds one to a checkpoint trained
+        # without, which changes its predictions, since it learned to read the padding as zero rows.
+        self.variable_length = variable_length and not use_attention
+        self.padding_waste = None
+        self.spacy_batch_size = spacy_batch_size
+        self.spacy_n_process = spacy_n_process
+        self.window_weighting = window_weighting
         # PassageTagger takes a dict of params
         self.params = {'repfile': self.scibert_path,
                        'tagger_path': self.tagger_path,
@@ -45,7 +109,10 @@ class HighlightExtractor:
                        'crf': self.crf,
                        'batch_size': self.batch_size,
                        'maxseqlen': self.maxseqlen,
-                       'maxclauselen': self.maxclauselen}
+                       'maxclauselen': self.maxclauselen,
+                       'max_clause_tokens': self.max_clause_tokens,
+                       'encoder_batch_size': self.encoder_batch_size,
+                       'variable_length': self.variable_length}
 
         # load tagging model
         model_ext = "att=%s_cont=%s_lstm=%s_bi=%s_crf=%s" % (
@@ -56,72 +123,242 @@ class HighlightExtractor:
         model_label_ind = os.path.join(self.tagger_path, "model_%s_label_ind.json" % model_ext)
         # build tagger
         self.nnt = PassageTagger(self.params)
-        self.nnt.tagger = model_from_json(model_config_file.read(),
-                                          custom_objects={"TensorAttention": TensorAttention,
-                                                          "HigherOrderTimeDistributedDense": HigherOrderTimeDistributedDense,
-                                                          "CRF": CRF})
+        if embedding_cache_size > 0 or embedding_cache_path:
+            self.nnt.embedding_cache = EmbeddingCache(model_fingerprint(self.scibert_path),
+                                                      capacity=embedding_cache_size, path=embedding_cache_path)
+        self.nnt.tagger, saved_seqlen = load_tagger(model_config_file.read(), model_weights_file_name,
+                                                    variable_length=bool(self.variable_length))
+        if self.variable_length is None:
+            self.variable_length = any(isinstance(layer, Masking) for layer in self.nnt.tagger.layers)
+        self.params["variable_length"] = self.variable_length
         if not self.params["use_attention"]:
-            self.params["maxseqlen"] = self.nnt.tagger.inputs[0].shape[1]
+            # the trained length stays the cap (and window size) for passages
+            self.params["maxseqlen"] = saved_seqlen or self.params["maxseqlen"]
+            if self.params["maxseqlen"] is None:
+                # never taken from the passages being tagged: a warmup passage would cap every later document
+                raise ValueError("%s does not record how many clauses per passage the tagger was trained on; "
+                                 "pass it as maxseqlen" % model_config_file.name)
             self.params["maxclauselen"] = None
-        self.nnt.tagger.load_weights(model_weights_file_name)
+        else:
+            # attention taggers are built for one passage and clause length
+            attention = [layer for layer in self.nnt.tagger.layers if isinstance(layer, TensorAttention)][0]
+            self.params["maxseqlen"], self.params["maxclauselen"] = attention.td1, attention.td2
+        # With early projection the word projection of an attention tagger runs on each chunk of
+        # encoder output, and the Keras models below start after it, so full 768-wide token
+        # states are never gathered into passages.
+        projection_layer = None
+        if early_projection and self.use_attention:
+            projection_layer = [layer for layer in self.nnt.tagger.layers
+                                if isinstance(layer, HigherOrderTimeDistributedDense)][0]
+            self.nnt.clause_projection = ClauseProjection.from_layer(projection_layer)
+            projected_shape = (self.params["maxseqlen"], self.params["maxclauselen"],
+                               self.nnt.clause_projection.output_dim)
+        self.crf_decoder = None
+        self.crf_inputs = None
+        if self.crf:
+            # decode in NumPy from the CRF layer's inputs, which gives the Viterbi path and the marginals together
+            crf_layer = [layer for layer in self.nnt.tagger.layers if isinstance(layer, CRF)][0]
+            self.crf_decoder = CRFDecoder.from_layer(crf_layer)
+            if projection_layer is None:
+                self.crf_inputs = Model(inputs=self.nnt.tagger.inputs, outputs=crf_layer.input)
+            else:
+                self.crf_inputs = layers_after(self.nnt.tagger, projection_layer, projected_shape, until=crf_layer)
+        # the Dense/BiLSTM/softmax head of a sentence tagger can run in NumPy instead of Keras
+        self.head = self.nnt.tagger
+        if numpy_head and not self.use_attention and not self.crf:
+            self.head = NumpyTagger.from_model(self.nnt.tagger)
+        elif projection_layer is not None:
+            self.head = layers_after(self.nnt.tagger, projection_layer, projected_shape)
+        # shapes the models get called with: clause token lengths and passage lengths
+        maxseqlen = self.params["maxseqlen"]
+        self.encoder_buckets = length_buckets(self.max_clause_tokens)
+        if self.variable_length:
+            self.tagger_buckets = list(range(8, maxseqlen, 8)) + [maxseqlen]
+        else:
+            # fixed-length taggers only ever see full passages
+            self.tagger_buckets = [maxseqlen]
+        if compiled:
+            # call the models through length-bucketed functions, all traced by `warmup`
+            self.nnt.encoder = CompiledModel(self.nnt.encoder, self.encoder_buckets)
+            if not isinstance(self.head, NumpyTagger):
+                self.head = CompiledModel(self.head, self.tagger_buckets, pad_side='left')
+            if self.crf_decoder is not None:
+                self.crf_inputs = CompiledModel(self.crf_inputs, self.tagger_buckets, pad_side='left')
         label_ind_json = json.load(open(model_label_ind))
         self.label_ind = {k: int(label_ind_json[k]) for k in label_ind_json}
+        self.rev_label_ind = {i: l for (l, i) in self.label_ind.items()}
+        # documents longer than the tagger input are tagged in windows of `maxseqlen` sentences,
+        # starting every `window_stride` sentences (half a window unless set)
+        self.window_size = self.params["maxseqlen"]
+        self.window_stride = window_stride
+        if self.window_stride is None:
+            self.window_stride = max(1, self.window_size // 2)
+        if not 0 < self.window_stride <= self.window_size:
+            raise ValueError("window_stride must be between 1 and maxseqlen (%d)" % self.window_size)
+        self.result_cache = None
+        if result_cache_backend is not None:
+            # everything besides the weights that changes the tagger output is part of the key
+            settings = {'variable_length': self.variable_length,
+                        'max_clause_tokens': self.max_clause_tokens,
+                        'maxseqlen': self.params["maxseqlen"],
+                        'maxclauselen': self.params["maxclauselen"],
+                        'early_projection': projection_layer is not None,
+                        'numpy_head': isinstance(self.head, NumpyTagger),
+                        'compiled': compiled,
+                        'crf_labels': 'viterbi' if self.crf else None}
+            self.result_cache = ResultCache(model_ext + "_" + json.dumps(settings, sort_keys=True),
+                                            weights_checksum(model_weights_file_name),
+                                            backend=result_cache_backend, ttl=result_cache_ttl)
 
-    def tag(self, text_or_path, from_file=False, parsed=True):
+    def warmup(self):
+        """Run synthetic passages through every encoder and tagger shape bucket and load the spaCy pipelines,
+        so the first real request doesn't pay for graph tracing and memory pool setup."""
+        list(segment_many(["Warm up the sentence splitter. And the parser."], tense=True))
+        get_nlp(tense=False)
+        for model in (self.nnt.encoder, self.head, self.crf_inputs):
+            if isinstance(model, CompiledModel):
+                model.warmup()
+        for num_tokens in self.encoder_buckets:
+            # [CLS] + words + [SEP]
+            self._tag_passages([[' '.join(['word'] * max(1, num_tokens - 2))]], synthetic=True)
+        for num_sentences in self.tagger_buckets:
+            self._tag_passages([['word'] * num_sentences], synthetic=True)
+
+    @staticmethod
+    def _cache_content(text_or_path, from_file=False, parsed=True):
+        """What a result is cached under: the raw text, or the list of sentences of parsed input."""
+        if from_file:
+            with open(text_or_path, 'r') as file:
+                text = file.read()
+            return text.split('\n') if parsed else text
+        if parsed and not isinstance(text_or_path, str):
+            return [str(sent) for sent in text_or_path]
+        return text_or_path
+
+    def _sentences(self, text_or_path, from_file=False, parsed=True, tense=True):
         if from_file:
             with open(text_or_path, 'r') as file:
                 text = file.read()
             if parsed:
                 doc = text.split('\n')
             else:
-                doc = nlp(text)
-                doc = [str(sent) for sent in doc.sents]
+                doc = get_nlp(tense)(text)
+                doc = list(doc.sents)
 
         else:
             if parsed:
                 doc = text_or_path
             else:
-                doc = nlp(text_or_path)
-                doc = [str(sent) for sent in doc.sents]
+                # keep the spans, so tense can be read from this parse instead of parsing each sentence again
+                doc = get_nlp(tense)(text_or_path)
+                doc = list(doc.sents)
+        return doc
 
-        print('Tagging', len(doc), 'sentences...')
+    def _tenses(self, doc):
+        """Tense for every sentence; parsed spans are reused, everything else is parsed in bulk."""
+        unparsed = [str(sent) for sent in doc if needs_tense_parse(sent)]
+        parsed_unparsed = get_nlp(tense=True).pipe(unparsed, batch_size=self.spacy_batch_size,
+                                                   n_process=self.spacy_n_process)
+        return [root_tense(next(parsed_unparsed)) if needs_tense_parse(sent) else root_tense(sent) for sent in doc]
 
-        tfile = open('temp_file.txt', mode='w')
-        for sent in doc:
-            tfile.write(str(sent).lower())
-            tfile.write('\n')
-        tfile.write('\n')
-        test_file = tfile.name
-        tfile.close()
+    def add_tense(self, df):
+        """Fill in the tense of rows tagged with `lazy_tense=True`, e.g. only for the chosen highlights."""
+        missing = df['tense'].isna()
+        if missing.any():
+            df = df.copy()
+            df.loc[missing, 'tense'] = self._tenses(df.loc[missing, 'sentence'].tolist())
+        return df
 
-        test_seq_lengths, test_generator = self.nnt.make_data(test_file,
-                                                              label_ind=self.label_ind,
-                                                              train=False)
+    def _tag_passages(self, passages, synthetic=False):
+        """Predictions for every passage, one (probs, path) pair each.
 
-        os.remove(test_file)
+        `probs` holds the label distribution of every sentence, shaped (sentences, labels). `path`
+        is the CRF's Viterbi label sequence, or None for softmax taggers, labeled by argmax.
+        `synthetic` passages (warmup) bypass the embedding cache and leave `padding_waste` alone,
+        so they can run while other threads are serving.
+        """
+        # every passage is its own sequence, so the generator batches them together
+        str_seqs = [[str(sent).lower().strip() for sent in doc] for doc in passages]
+        test_seq_lengths, test_generator = self.nnt.make_data_from_sequences(str_seqs,
+                                                                             label_ind=self.label_ind,
+                                                                             train=False,
+                                                                             use_embedding_cache=not synthetic,
+                                                                             memoize_clauses=True)
 
-        pred_probs1, pred_label_seqs, _ = self.nnt.predict(test_generator, test_seq_lengths, tagger=self.nnt.tagger)
+        if self.crf_decoder is None:
+            pred_probs1, _, _ = self.nnt.predict(test_generator, test_seq_lengths, tagger=self.head)
+            paths = [None] * len(pred_probs1)
+        else:
+            pred_probs1, paths = self._crf_decode(test_generator, test_seq_lengths)
 
-        pred_label_seqs = from_BIO(pred_label_seqs)[0] #  list of list, get first
+        if not synthetic:
+            self.padding_waste, fixed_padding_waste = test_generator.padding_waste()
+            print('Encoder padding waste: %.1f%% (%.1f%% if padded to %d tokens)' % (
+                100 * self.padding_waste, 100 * fixed_padding_waste, test_generator.max_clause_tokens))
+            if self.nnt.embedding_cache is not None:
+                print('Embedding cache:', self.nnt.embedding_cache.stats())
 
-        sentences = [str(sent) for sent in doc]
+        # they pre-pad probs
+        results = []
+        for doc, probs, path in zip(passages, pred_probs1, paths):
+            start = len(probs) - min(len(doc), len(probs))
+            results.append((probs[start:], None if path is None else path[start:]))
+        return results
+
+    def _crf_decode(self, generator, seq_lengths):
+        """Label marginals and Viterbi paths of every passage, from the CRF layer's inputs.
+
+        Without a Masking layer the CRF runs over the whole padded passage, so it is decoded unmasked.
+        """
+        marginals = []
+        paths = []
+        for i in range(len(generator)):
+            batch_X, _ = generator[i]
+            crf_inputs = np.asarray(self.crf_inputs.predict_on_batch(batch_X))
+            mask = None
+            if self.variable_length:
+                # the CRF gets the Masking layer's mask; passages are left-padded, so their real clauses are the last steps
+                steps = crf_inputs.shape[1]
+                batch_lengths = np.minimum(seq_lengths[i * generator.batch_size:(i + 1) * generator.batch_size], steps)
+                mask = np.arange(steps)[None, :] >= steps - batch_lengths[:, None]
+            batch_paths, batch_marginals = self.crf_decoder.decode(crf_inputs, mask)
+            paths.extend(batch_paths)
+            marginals.extend(batch_marginals)
+        return marginals, paths
+
+    def _labels(self, probs, s_len, path=None):
+        """Labels (BIO prefixes removed) and their probabilities for one passage of `s_len` sentences.
+
+        Labels follow `path` when given (a CRF's Viterbi path, so B_/I_ sequences are valid),
+        otherwise the most probable label of each sentence.
+        """
+        if path is None:
+            path = np.argmax(probs, axis=-1)
+        pred_label_seq = [self.rev_label_ind[pred] for pred in path]
+        # sentences the tagger could not see are labeled none, like `PassageTagger.predict` does
+        pred_label_seq = ["none"] * (s_len - len(pred_label_seq)) + pred_label_seq
+        return from_BIO([pred_label_seq])[0], probs[np.arange(len(path)), path]
+
+    def _tag_document(self, doc, tag_passages):
+        """Tag one document through overlapping windows and stitch them back together."""
+        windows = sliding_windows(len(doc), self.window_size, self.window_stride)
+        window_results = tag_passages([doc[start:end] for start, end in windows])
+        return self._stitch(doc, windows, window_results)
+
+    def _stitch(self, doc, windows, window_results):
+        if len(windows) == 1:
+            probs, path = window_results[0]
+            return self._labels(probs, len(doc), path)
+        # Overlapping windows are merged through their label distributions (CRF marginals), so
+        # stitched documents are labeled by the most probable label of each sentence.
+        window_probs = [probs for probs, _ in window_results]
+        return self._labels(stitch_windows(windows, window_probs, len(doc), self.window_weighting), len(doc))
+
+    @staticmethod
+    def _to_frame(sentences, pred_label_seqs, pred_probs, tenses):
         s_len = len(sentences)
-        pred_probs = np.max(pred_probs1[0], axis=-1)[-s_len:] # they pre-pad probs
-
-        def get_tense(s):
-            s = nlp(s)
-            tense = 'UNK'
-            for token in s:
-                if token.dep_ == 'ROOT':
-                    try:
-                        tense = token.morph.get('Tense')[0]
-                    except IndexError:
-                        pass
-            return tense
-
-        tenses = [get_tense(s) for s in sentences]
         # return sentences, pred_probs, pred_label_seqs, pred_probs1
-        if s_len > 40:
+        if len(pred_probs) != s_len:
             a = {'sentence': sentences, 'tag': pred_label_seqs, 'prob': pred_probs, 'tense': tenses}
             df = pd.DataFrame.from_dict(a, orient='index')
             df = df.transpose()
@@ -134,6 +371,126 @@ class HighlightExtractor:
                            'prob': pred_probs, 'tense': tenses})
             return df
 
+    def tag(self, text_or_path, from_file=False, parsed=True, tag_passages=None, lazy_tense=False):
+        """Tag one document; longer ones than the tagger input are tagged in overlapping windows."""
+        if tag_passages is None:
+            tag_passages = self._tag_passages
+        if self.result_cache is not None:
+            cache_kind = 'tag:parsed=%s:lazy_tense=%s:stride=%s:weighting=%s' % (
+                parsed, lazy_tense, self.window_stride, self.window_weighting)
+            cache_content = self._cache_content(text_or_path, from_file=from_file, parsed=parsed)
+            df = self.result_cache.get(cache_kind, cache_content)
+            if df is not None:
+                return df.copy()
+        doc = self._sentences(text_or_path, from_file=from_file, parsed=parsed, tense=not lazy_tense)
+        if len(doc) == 0:
+            # nothing left after segmentation, e.g. text that was all non-ASCII
+            return pd.DataFrame(columns=['sentence', 'tag', 'prob', 'tense'])
+
+        print('Tagging', len(doc), 'sentences...')
+
+        pred_label_seqs, pred_probs = self._tag_document(doc, tag_passages)
+
+        sentences = [str(sent) for sent in doc]
+        tenses = [None] * len(doc) if lazy_tense else self._tenses(doc)
+        df = self._to_frame(sentences, pred_label_seqs, pred_probs, tenses)
+        df.attrs['padding_waste'] = self.padding_waste
+        if self.result_cache is not None:
+            self.result_cache.set(cache_kind, cache_content, df.copy())
+        return df
+
+    def tag_windows(self, windows, parsed=False, tag_passages=None, lazy_tense=False):
+        """Tag all windows of one document in a single batched pass.
+
+        `windows` holds either raw text chunks (`parsed=False`) or lists of sentences
+        (`parsed=True`); each one must fit in the tagger's `maxseqlen`. The per-window
+        results are concatenated, in order, into one DataFrame like `tag` returns.
+        `tag_passages` lets a `MicroBatcher` run the model pass on behalf of the caller.
+        With `lazy_tense` the tense column is left empty; see `add_tense`.
+        """
+        if tag_passages is None:
+            tag_passages = self._tag_passages
+        if self.result_cache is not None:
+            # windows are kept apart in the key since they are tagged independently
+            cache_kind = 'windows:parsed=%s:lazy_tense=%s' % (parsed, lazy_tense)
+            cache_content = [self._cache_content(window, parsed=parsed) for window in windows]
+            df = self.result_cache.get(cache_kind, cache_content)
+            if df is not None:
+                return df.copy()
+        if parsed:
+            docs = [self._sentences(window, parsed=True) for window in windows]
+        else:
+            docs = list(segment_many(windows, tense=not lazy_tense, batch_size=self.spacy_batch_size,
+                                     n_process=self.spacy_n_process))
+        docs = [doc for doc in docs if len(doc) > 0]
+        if len(docs) == 0:
+            return pd.DataFrame(columns=['sentence', 'tag', 'prob', 'tense'])
+
+        print('Tagging', sum(len(doc) for doc in docs), 'sentences in', len(docs), 'windows...')
+
+        frames = []
+        for doc, (probs, path) in zip(docs, tag_passages(docs)):
+            pred_label_seqs, pred_probs = self._labels(probs, len(doc), path)
+            sentences = [str(sent) for sent in doc]
+            tenses = [None] * len(doc) if lazy_tense else self._tenses(doc)
+            frames.append(self._to_frame(sentences, pred_label_seqs, pred_probs, tenses))
+        df = pd.concat(frames)
+        df.attrs['padding_waste'] = self.padding_waste
+        if self.result_cache is not None:
+            self.result_cache.set(cache_kind, cache_content, df.copy())
+        return df
+
+    def tag_many(self, texts, batch_size=None, parsed=False, lazy_tense=False):
+        """Tag a stream of documents, packing their windows into shared model batches.
+
+        Documents are split into overlapping `maxseqlen`-sentence windows (see `tag`) and
+        windows from different documents share encoder/tagger passes of `batch_size` windows
+        (default: the generator batch size). One DataFrame per document is yielded, in input
+        order, as soon as all of its windows are tagged.
+        """
+        if batch_size is None:
+            batch_size = self.batch_size
+        if parsed:
+            docs = (list(text) for text in texts)
+        else:
+            docs = segment_many(texts, tense=not lazy_tense, batch_size=self.spacy_batch_size,
+                                n_process=self.spacy_n_process)
+
+        pending = deque()  # [sentences, window spans, per-window results] in input order
+        windows = []  # (pending entry, window sentences)
+
+        def run(num_windows):
+            batch = windows[:num_windows]
+            del windows[:num_windows]
+            results = self._tag_passages([window for _, window in batch])
+            for (entry, _), result in zip(batch, results):
+                entry[2].append(result)
+
+        def finished():
+            while pending and len(pending[0][2]) == len(pending[0][1]):
+                doc, doc_windows, results = pending.popleft()
+                yield self._doc_frame(doc, doc_windows, results, lazy_tense)
+
+        for doc in docs:
+            doc_windows = sliding_windows(len(doc), self.window_size, self.window_stride) if len(doc) else []
+            entry = [doc, doc_windows, []]
+            pending.append(entry)
+            windows.extend((entry, doc[start:end]) for start, end in doc_windows)
+            if len(windows) >= batch_size:
+                run(len(windows) // batch_size * batch_size)
+            yield from finished()
+        if windows:
+            run(len(windows))
+        yield from finished()
+
+    def _doc_frame(self, doc, windows, window_results, lazy_tense=False):
+        if len(windows) == 0:
+            return pd.DataFrame(columns=['sentence', 'tag', 'prob', 'tense'])
+        pred_label_seqs, pred_probs = self._stitch(doc, windows, window_results)
+        sentences = [str(sent) for sent in doc]
+        tenses = [None] * len(doc) if lazy_tense else self._tenses(doc)
+        return self._to_frame(sentences, pred_label_seqs, pred_probs, tenses)
+
     @staticmethod
     def get_highlights(df):
         regex = re.compile(r' \([^)]*\)')  # we need this to remove parenths
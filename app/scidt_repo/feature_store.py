@@ -0,0 +1,51 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+
+def file_checksum(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class FeatureStore(object):
+    '''Encoder outputs for whole labelled files, written once to memory-mapped .npy arrays.
+
+    A file's clauses are encoded in order into one float32 array with a row per clause
+    (the CLS vector, or the first `maxclauselen` token states for attention models). Arrays
+    are keyed by the file name, a checksum of its contents, the encoder fingerprint and
+    whatever else changes the encoder output, so an edited file or a new encoder is
+    extracted again and everything else is reused across epochs and runs.
+    '''
+
+    def __init__(self, root, fingerprint):
+        self.root = root
+        self.fingerprint = fingerprint
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, filename, **settings):
+        key = hashlib.sha1(json.dumps([self.fingerprint, file_checksum(filename), settings],
+                                      sort_keys=True).encode('utf8')).hexdigest()
+        return os.path.join(self.root, "%s.%s.npy" % (os.path.basename(filename), key[:16]))
+
+    def features(self, filename, clauses, encode, row_shape, chunk_size=1024, **settings):
+        '''Memory-mapped features of `clauses` (read from `filename`), running `encode` on them only
+        if this file has not been extracted with these settings before.'''
+        path = self.path(filename, **settings)
+        if not os.path.exists(path):
+            print("Extracting features of %d clauses from %s" % (len(clauses), filename))
+            # written under a temporary name, so an interrupted extraction is never picked up
+            partial = path + ".partial.npy"
+            features = np.lib.format.open_memmap(partial, mode='w+', dtype=np.float32,
+                                                 shape=(len(clauses),) + tuple(row_shape))
+            for start in range(0, len(clauses), chunk_size):
+                features[start:start + chunk_size] = encode(clauses[start:start + chunk_size])
+            features.flush()
+            del features
+            os.replace(partial, path)
+        return np.load(path, mmap_mode='r')
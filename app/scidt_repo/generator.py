@@ -1,10 +1,73 @@
+import threading
+
 import numpy as np
 from keras.utils import Sequence
 import codecs
 
+from .numpy_tagger import ACTIVATIONS
+
+class BufferPool(object):
+    """A ring of reusable float32 batch arrays.
+
+    `take` hands out the next slot's array, zeroed, reallocating it only when the shape changed.
+    An array is handed out again only after `size` more `take`s, so size the ring above the
+    number of batches that can be alive at once: Keras queues up to 10 (`max_queue_size`)
+    ahead of the one it is training on, and one more is being built. Generators keep one
+    ring for X and another for Y, so each batch uses one slot of each.
+    """
+
+    def __init__(self, size=16):
+        self.size = size
+        self._buffers = [None] * size
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def take(self, shape, fill=0):
+        with self._lock:
+            slot = self._next
+            self._next = (self._next + 1) % self.size
+            buffer = self._buffers[slot]
+            if buffer is None or buffer.shape != shape:
+                buffer = self._buffers[slot] = np.empty(shape, dtype=np.float32)
+            buffer[...] = fill
+            return buffer
+
+def one_hot(y_inds, num_labels, out):
+    """Write the one-hot rows of the (batch, time) label indices `y_inds` into the zeroed `out`."""
+    batch, steps = y_inds.shape
+    out[np.arange(batch)[:, None], np.arange(steps)[None, :], y_inds] = 1
+    return out
+
+class ClauseProjection(object):
+    """The word projection (`HigherOrderTimeDistributedDense`) of an attention tagger, in NumPy.
+
+    Given to `BertDiscourseGenerator`, it is applied to each chunk of encoder output as soon as
+    the encoder returns it, so only `output_dim` features per token are kept instead of 768, and
+    batches come out ready for the layers after the projection. An all-zero input row, as in
+    passage padding, projects to `empty_row`.
+    """
+
+    def __init__(self, kernel, bias, activation='linear'):
+        if activation not in ACTIVATIONS:
+            raise ValueError("Unsupported projection activation: %s" % activation)
+        self.kernel = np.asarray(kernel, dtype=np.float32)
+        self.bias = np.asarray(bias, dtype=np.float32).reshape(-1)
+        self.activation = ACTIVATIONS[activation]
+        self.output_dim = self.kernel.shape[1]
+        self.empty_row = self.activation(self.bias)
+
+    @classmethod
+    def from_layer(cls, layer):
+        kernel, bias = layer.get_weights()
+        return cls(kernel, bias, activation=layer.get_config()['activation'])
+
+    def __call__(self, states):
+        return self.activation(np.dot(states, self.kernel) + self.bias)
+
 class DiscourseGenerator(Sequence):
 
-    def __init__(self, rep_reader, str_seqs, label_seqs, label_ind, batch_size, use_attention, maxseqlen, maxclauselen, train, input_size):
+    def __init__(self, rep_reader, str_seqs, label_seqs, label_ind, batch_size, use_attention, maxseqlen, maxclauselen, train, input_size,
+                 buffer_pool_size=16):
         self.rep_reader = rep_reader
         self.str_seqs, self.label_seqs = str_seqs, label_seqs
         self.label_ind = label_ind
@@ -14,6 +77,8 @@ class DiscourseGenerator(Sequence):
         self.maxclauselen = maxclauselen
         self.train = train
         self.input_size = input_size
+        self.x_buffers = BufferPool(buffer_pool_size)
+        self.y_buffers = BufferPool(buffer_pool_size)
 
     def __len__(self):
         return int(np.ceil(len(self.str_seqs) / float(self.batch_size)))
@@ -29,17 +94,16 @@ class DiscourseGenerator(Sequence):
             return self.make_data_train(str_seqs, label_seqs)
         else:
             return self.make_data_test(str_seqs)
+
+    def x_shape(self, num_seqs, seqlen):
+        if self.use_attention:
+            return (num_seqs, seqlen, self.maxclauselen, self.input_size)
+        return (num_seqs, seqlen, self.input_size)
     
     def make_data_train(self,str_seqs, label_seqs):
-        X = []
-        Y = []
-        Y_inds = []
-        for str_seq, label_seq in zip(str_seqs, label_seqs):
-            if self.use_attention:
-                x = np.zeros((self.maxseqlen, self.maxclauselen, self.input_size))
-            else:
-                x = np.zeros((self.maxseqlen, self.input_size))
-            y_ind = np.zeros(self.maxseqlen)
+        X = self.x_buffers.take(self.x_shape(len(str_seqs), self.maxseqlen))
+        Y_inds = np.zeros((len(str_seqs), self.maxseqlen), dtype=int)
+        for j, (str_seq, label_seq) in enumerate(zip(str_seqs, label_seqs)):
             seq_len = len(str_seq)
             # The following conditional is true only when we've already trained, and one of the sequences in the test set is longer than the longest sequence in training.
             if seq_len > self.maxseqlen:
@@ -50,29 +114,18 @@ class DiscourseGenerator(Sequence):
                 if self.use_attention:
                     if len(clause_rep) > self.maxclauselen:
                         clause_rep = clause_rep[:self.maxclauselen]
-                    x[-seq_len+i][-len(clause_rep):] = clause_rep
+                    X[j, -seq_len+i, -len(clause_rep):] = clause_rep
                 else:
-                    #x[-seq_len+i] = np.max(clause_rep, axis=0)
-                    x[-seq_len+i] = clause_rep[0,:]
-                y_ind[-seq_len+i] = self.label_ind[label]
-            X.append(x)
-            Y_inds.append(y_ind)
-
-        for y_ind in Y_inds:
-            y = np.zeros((self.maxseqlen, len(self.label_ind)))
-            for i, y_ind_i in enumerate(y_ind):
-                y[i][y_ind_i.astype(int)] = 1
-            Y.append(y)
-        
-        return np.asarray(X), np.asarray(Y) # One-hot representation of labels
+                    #X[j, -seq_len+i] = np.max(clause_rep, axis=0)
+                    X[j, -seq_len+i] = clause_rep[0,:]
+                Y_inds[j, -seq_len+i] = self.label_ind[label]
+
+        Y = one_hot(Y_inds, len(self.label_ind), self.y_buffers.take((len(str_seqs), self.maxseqlen, len(self.label_ind))))
+        return X, Y # One-hot representation of labels
 
     def make_data_test(self,str_seqs):
-        X = []
-        for str_seq in str_seqs:
-            if self.use_attention:
-                x = np.zeros((self.maxseqlen, self.maxclauselen, self.input_size))
-            else:
-                x = np.zeros((self.maxseqlen, self.input_size))
+        X = self.x_buffers.take(self.x_shape(len(str_seqs), self.maxseqlen))
+        for j, str_seq in enumerate(str_seqs):
             seq_len = len(str_seq)
             # The following conditional is true only when we've already trained, and one of the sequences in the test set is longer than the longest sequence in training.
             if seq_len > self.maxseqlen:
@@ -83,19 +136,60 @@ class DiscourseGenerator(Sequence):
                 if self.use_attention:
                     if len(clause_rep) > self.maxclauselen:
                         clause_rep = clause_rep[:self.maxclauselen]
-                    x[-seq_len+i][-len(clause_rep):] = clause_rep
+                    X[j, -seq_len+i, -len(clause_rep):] = clause_rep
                 else:
-                    #x[-seq_len+i] = np.mean(clause_rep, axis=0)
-                    x[-seq_len+i] = clause_rep[0,:]
-            X.append(x)
-        return np.asarray(X), np.asarray([]) # One-hot representation of labels
+                    #X[j, -seq_len+i] = np.mean(clause_rep, axis=0)
+                    X[j, -seq_len+i] = clause_rep[0,:]
+        return X, np.asarray([]) # One-hot representation of labels
+
+class TokenizedClauses(object):
+    """Wordpiece ids of the distinct (lowercased) clauses of a dataset, each tokenized only once.
+
+    `PassageTagger.make_data` builds one per dataset and hands it to both the clause length
+    statistics and the generator, so neither the statistics nor later epochs tokenize again.
+    Clauses are tokenized when first asked for, so those served from a cache never are.
+    """
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self.token_ids = {}
+
+    def add(self, clauses):
+        new = list(dict.fromkeys(clause.lower() for clause in clauses if clause.lower() not in self.token_ids))
+        if not new:
+            return
+        if hasattr(self.tokenizer, "batch_encode"):
+            encoded = self.tokenizer.batch_encode(new)
+        else:
+            encoded = [np.asarray(self.tokenizer.encode(clause)[0], dtype="int32") for clause in new]
+        self.token_ids.update(zip(new, encoded))
+
+    def lengths(self, clauses):
+        """Token count of every clause, [CLS] and [SEP] included."""
+        self.add(clauses)
+        return np.array([len(self.token_ids[clause.lower()]) for clause in clauses], dtype=int)
+
+    def get(self, clauses, max_len=None):
+        """Token ids of every clause; longer than `max_len` keeps [CLS] and the trailing [SEP], like `encode(..., max_len=...)`."""
+        self.add(clauses)
+        all_indices = []
+        for clause in clauses:
+            indices = self.token_ids[clause.lower()]
+            if max_len is not None and len(indices) > max_len:
+                indices = np.concatenate([indices[:max_len - 1], indices[-1:]])
+            all_indices.append(indices)
+        return all_indices
 
 class BertDiscourseGenerator(Sequence):
 
-    def __init__(self, bert, tokenizer, str_seqs, label_seqs, label_ind, batch_size, use_attention, maxseqlen, maxclauselen, train, input_size=768):
+    def __init__(self, bert, tokenizer, str_seqs, label_seqs, label_ind, batch_size, use_attention, maxseqlen, maxclauselen, train, input_size=768,
+                 max_clause_tokens=512, encoder_batch_size=64, embedding_cache=None, variable_length=False, tokenized=None,
+                 buffer_pool_size=16, clause_projection=None, memoize_clauses=False):
         
         self.bert = bert
         self.tokenizer = tokenizer
+        # shared with whoever built the dataset, and kept across epochs
+        self.tokenized = tokenized if tokenized is not None else TokenizedClauses(tokenizer)
         
         self.str_seqs, self.label_seqs = str_seqs, label_seqs
         self.label_ind = label_ind
@@ -105,6 +199,29 @@ class BertDiscourseGenerator(Sequence):
         self.maxclauselen = maxclauselen
         self.train = train
         self.input_size = input_size
+        self.encoder_batch_size = encoder_batch_size
+        # An encoder built with a fixed seq_len can't take shorter batches, so pad to that length instead.
+        # (No encoder at all when the features are precomputed, see CachedDiscourseGenerator.)
+        encoder_seq_len = bert.inputs[0].shape[1] if bert is not None else None
+        self.encoder_seq_len = getattr(encoder_seq_len, "value", encoder_seq_len)
+        if self.encoder_seq_len:
+            max_clause_tokens = min(max_clause_tokens, self.encoder_seq_len)
+        self.max_clause_tokens = max_clause_tokens
+        # Only CLS vectors are cached; token states for attention models are too large to keep around.
+        self.embedding_cache = None if use_attention else embedding_cache
+        # A tagger with a free time dimension only needs each batch padded to its longest passage.
+        self.variable_length = variable_length
+        self.x_buffers = BufferPool(buffer_pool_size)
+        self.y_buffers = BufferPool(buffer_pool_size)
+        # attention models only: project token states right after the encoder
+        self.clause_projection = clause_projection if use_attention else None
+        self.real_tokens = 0
+        self.padded_tokens = 0
+        self.num_clauses = 0
+        # Encoder output of every clause this generator has encoded, so sentences repeated across
+        # its batches (overlapping windows of one document) are encoded once, attention models
+        # included. Meant for one inference pass; a training set would not fit.
+        self.clause_vectors = {} if memoize_clauses else None
 
     def __len__(self):
         return int(np.ceil(len(self.str_seqs) / float(self.batch_size)))
@@ -120,107 +237,180 @@ class BertDiscourseGenerator(Sequence):
             return self.make_data_train(str_seqs, label_seqs)
         else:
             return self.make_data_test(str_seqs)
+
+    def x_shape(self, num_seqs, seqlen):
+        if self.use_attention:
+            return (num_seqs, seqlen, self.maxclauselen, self.token_size())
+        return (num_seqs, seqlen, self.input_size)
+
+    def token_size(self):
+        return self.input_size if self.clause_projection is None else self.clause_projection.output_dim
+
+    def empty_row(self):
+        # what a padding clause looks like to the tagger
+        return 0 if self.clause_projection is None else self.clause_projection.empty_row
+
+    def padding_waste(self):
+        """Fraction of the tokens fed to the encoder so far that were padding,
+        next to what it would have been with every clause padded to `max_clause_tokens`."""
+        if self.padded_tokens == 0:
+            return 0.0, 0.0
+        fixed_tokens = self.num_clauses * max(self.max_clause_tokens, self.encoder_seq_len or 0)
+        return 1 - self.real_tokens / self.padded_tokens, 1 - self.real_tokens / fixed_tokens
+
+    def encode_clauses(self, clauses):
+        """Encode clauses, each distinct one once per batch (or once per generator, see `clause_vectors`)."""
+        if not clauses:
+            return np.zeros((0,) + self.x_shape(0, 0)[2:], dtype=np.float32)
+        # overlapping windows repeat sentences
+        vectors = self.clause_vectors if self.clause_vectors is not None else {}
+        new = list(dict.fromkeys(clause.lower() for clause in clauses if clause.lower() not in vectors))
+        if new:
+            vectors.update(zip(new, self._encode_cached(new)))
+        return np.stack([vectors[clause.lower()] for clause in clauses])
+
+    def _encode_cached(self, clauses):
+        """Encode distinct clauses, serving the ones already in `embedding_cache` without touching the encoder."""
+        if self.embedding_cache is None:
+            return self._encode_buckets(clauses)
+        # the token cap changes what the encoder sees, so it is part of the key
+        keys = ["%d\t%s" % (self.max_clause_tokens, clause.lower()) for clause in clauses]
+        cached = self.embedding_cache.get_many(keys)
+        missing = [i for i, vector in enumerate(cached) if vector is None]
+        embedding = np.zeros((len(clauses), self.input_size), dtype=np.float32)
+        for i, vector in enumerate(cached):
+            if vector is not None:
+                embedding[i] = vector
+        if missing:
+            encoded = self._encode_buckets([clauses[i] for i in missing])
+            embedding[missing] = encoded
+            self.embedding_cache.put_many([keys[i] for i in missing], encoded)
+        return embedding
+
+    def _encode_buckets(self, clauses):
+        """Run the encoder over clauses grouped into buckets of similar token length.
+
+        Each bucket is only padded to its own longest clause (or to `maxclauselen` when the
+        tagger needs token states), instead of every clause being padded to 512 tokens.
+        Returns the CLS vectors, or the first `maxclauselen` token states with attention.
+        """
+        all_indices = self.tokenized.get(clauses, max_len=self.max_clause_tokens)
+        lengths = np.array([len(indices) for indices in all_indices])
+        order = np.argsort(lengths, kind="stable")
+
+        if self.use_attention:
+            embedding = np.zeros((len(clauses), self.maxclauselen, self.token_size()), dtype=np.float32)
+        else:
+            embedding = np.zeros((len(clauses), self.input_size), dtype=np.float32)
+        for start in range(0, len(order), self.encoder_batch_size):
+            bucket = order[start:start + self.encoder_batch_size]
+            if self.encoder_seq_len:
+                pad_len = self.encoder_seq_len
+            elif self.use_attention:
+                pad_len = max(lengths[bucket].max(), self.maxclauselen)
+            else:
+                pad_len = lengths[bucket].max()
+            if hasattr(self.bert, "padded_length"):
+                # a length-bucketed encoder (CompiledModel) would pad further; pad to, and count, what it runs
+                pad_len = self.bert.padded_length(pad_len)
+            bucket_indices = np.zeros((len(bucket), pad_len), dtype="int32")
+            bucket_segments = np.zeros((len(bucket), pad_len), dtype="int32")
+            for row, i in enumerate(bucket):
+                bucket_indices[row, :lengths[i]] = all_indices[i]
+            bert_embedding = self.bert.predict([bucket_indices, bucket_segments], batch_size=len(bucket))
+            if bert_embedding.ndim == 2:
+                # CLS-only encoder
+                embedding[bucket] = bert_embedding
+            elif self.clause_projection is not None:
+                embedding[bucket] = self.clause_projection(bert_embedding[:, :self.maxclauselen, :])
+            elif self.use_attention:
+                embedding[bucket] = bert_embedding[:, :self.maxclauselen, :]
+            else:
+                embedding[bucket] = bert_embedding[:, 0, :]
+            self.real_tokens += int(lengths[bucket].sum())
+            self.padded_tokens += len(bucket) * int(pad_len)
+        self.num_clauses += len(clauses)
+        return embedding
+
+    def batch_seqlen(self, para_lens):
+        if self.variable_length:
+            return max(max(para_lens), 1)
+        return self.maxseqlen
     
     def make_data_train(self,str_seqs, label_seqs):
-        X = []
-        Y = []
-        Y_inds = []
+        Y_inds = np.zeros((len(str_seqs), self.maxseqlen), dtype=int)
         
-        all_indices = []
-        all_segments = []
+        all_clauses = []
         para_lens = []
-        for str_seq, label_seq in zip(str_seqs, label_seqs):
-            if self.use_attention:
-                x = np.zeros((self.maxseqlen, self.maxclauselen, self.input_size))
-            else:
-                x = np.zeros((self.maxseqlen, self.input_size))
-            y_ind = np.zeros(self.maxseqlen)
-            
+        for j, (str_seq, label_seq) in enumerate(zip(str_seqs, label_seqs)):
             seq_len = len(str_seq)
             if seq_len > self.maxseqlen:
                 str_seq = str_seq[:self.maxseqlen]
                 seq_len = self.maxseqlen
             
-            para_indices = []
-            para_segments = []
             for i, (clause, label) in enumerate(zip(str_seq, label_seq)):
-                indices, segments = self.tokenizer.encode(clause.lower(), max_len=512)
-                para_indices.append(indices)
-                para_segments.append(segments)
-                
-                y_ind[-seq_len+i] = self.label_ind[label]
+                Y_inds[j, -seq_len+i] = self.label_ind[label]
             
-            para_lens.append(len(para_indices))
-            all_indices.extend(para_indices)
-            all_segments.extend(para_segments)
-            Y_inds.append(y_ind)
+            para_lens.append(len(str_seq))
+            all_clauses.extend(str_seq)
             
-        bert_embedding = self.bert.predict([np.array(all_indices), np.array(all_segments)], batch_size=len(all_indices))[:,:self.maxclauselen,:]
-        
-        if self.use_attention:
-            X = np.zeros((len(str_seqs), self.maxseqlen, self.maxclauselen, self.input_size))
-        else:
-            X = np.zeros((len(str_seqs), self.maxseqlen, self.input_size))
+        bert_embedding = self.encode_clauses(all_clauses)
+        seqlen = self.batch_seqlen(para_lens)
         
+        X = self.x_buffers.take(self.x_shape(len(str_seqs), seqlen), fill=self.empty_row())
         cumulative_index = 0
         for i, para_len in enumerate(para_lens):
-            if self.use_attention:
-                X[i,-para_len:,:,:] = bert_embedding[cumulative_index: cumulative_index+para_len,:,:]
-            else:
-                #x[-seq_len:,:] = np.max(bert_embedding[cumulative_index: cumulative_index+para_len,:,:],axis=1)
-                X[i,-para_len:,:] = bert_embedding[cumulative_index: cumulative_index+para_len,0,:]
+            X[i,-para_len:] = bert_embedding[cumulative_index: cumulative_index+para_len]
             cumulative_index += para_len
 
-        for y_ind in Y_inds:
-            y = np.zeros((self.maxseqlen, len(self.label_ind)))
-            for i, y_ind_i in enumerate(y_ind):
-                y[i][y_ind_i.astype(int)] = 1
-            Y.append(y)
-        
-        return X, np.asarray(Y) # One-hot representation of labels
+        Y = one_hot(Y_inds[:, -seqlen:], len(self.label_ind), self.y_buffers.take((len(str_seqs), seqlen, len(self.label_ind))))
+        return X, Y # One-hot representation of labels
     
     def make_data_test(self,str_seqs):
-        X = []
-        
-        all_indices = []
-        all_segments = []
+        all_clauses = []
         para_lens = []
         for str_seq in str_seqs:
-            if self.use_attention:
-                x = np.zeros((self.maxseqlen, self.maxclauselen, self.input_size))
-            else:
-                x = np.zeros((self.maxseqlen, self.input_size))
-            
             seq_len = len(str_seq)
             if seq_len > self.maxseqlen:
                 str_seq = str_seq[:self.maxseqlen]
                 seq_len = self.maxseqlen
             
-            para_indices = []
-            para_segments = []
-            for i, clause in enumerate(str_seq):
-                indices, segments = self.tokenizer.encode(clause.lower(), max_len=512)
-                para_indices.append(indices)
-                para_segments.append(segments)
-                            
-            para_lens.append(len(para_indices))
-            all_indices.extend(para_indices)
-            all_segments.extend(para_segments)
+            para_lens.append(len(str_seq))
+            all_clauses.extend(str_seq)
             
-        bert_embedding = self.bert.predict([np.array(all_indices), np.array(all_segments)], batch_size=len(all_indices))[:,:self.maxclauselen,:]
-        
-        if self.use_attention:
-            X = np.zeros((len(str_seqs), self.maxseqlen, self.maxclauselen, self.input_size))
-        else:
-            X = np.zeros((len(str_seqs), self.maxseqlen, self.input_size))
+        bert_embedding = self.encode_clauses(all_clauses)
+        seqlen = self.batch_seqlen(para_lens)
         
+        X = self.x_buffers.take(self.x_shape(len(str_seqs), seqlen), fill=self.empty_row())
         cumulative_index = 0
         for i, para_len in enumerate(para_lens):
-            if self.use_attention:
-                X[i,-para_len:,:,:] = bert_embedding[cumulative_index: cumulative_index+para_len,:,:]
-            else:
-                #x[-para_len:,:] = np.max(bert_embedding[cumulative_index: cumulative_index+para_len,:,:],axis=1)
-                X[i,-para_len:,:] = bert_embedding[cumulative_index: cumulative_index+para_len,0,:]
+            X[i,-para_len:] = bert_embedding[cumulative_index: cumulative_index+para_len]
             cumulative_index += para_len
         
-        return X, np.asarray([])
\ No newline at end of file
+        return X, np.asarray([])
+
+class CachedDiscourseGenerator(BertDiscourseGenerator):
+    """Serve batches from precomputed encoder features instead of running the encoder.
+
+    `features` holds one row per clause of the file (see `FeatureStore`), in file order.
+    Passages are kept as lists of row numbers into it, so batching, truncation to `maxseqlen`
+    and label handling are exactly those of `BertDiscourseGenerator`.
+    """
+
+    def __init__(self, features, str_seqs, label_seqs, label_ind, batch_size, use_attention, maxseqlen, maxclauselen, train, input_size=768,
+                 variable_length=False, buffer_pool_size=16, max_clause_tokens=512):
+        row_seqs = []
+        row = 0
+        for str_seq in str_seqs:
+            row_seqs.append(list(range(row, row + len(str_seq))))
+            row += len(str_seq)
+        if row != len(features):
+            raise ValueError("Expected features for %d clauses, got %d" % (row, len(features)))
+        super(CachedDiscourseGenerator, self).__init__(None, None, row_seqs, label_seqs, label_ind, batch_size, use_attention,
+                                                       maxseqlen, maxclauselen, train, input_size=input_size,
+                                                       max_clause_tokens=max_clause_tokens, variable_length=variable_length,
+                                                       buffer_pool_size=buffer_pool_size)
+        self.features = features
+
+    def encode_clauses(self, rows):
+        return self.features[np.asarray(rows, dtype=int)]
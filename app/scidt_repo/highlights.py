@@ -0,0 +1,50 @@
+"""
+Picking the highlights of a tagged paper, for /send and for the job API.
+"""
+import pandas as pd
+
+
+def select_highlights(finalTags):
+    # ONE ROW PER SENTENCE | FRAMES CONCATENATED FROM WINDOWS REPEAT INDEX LABELS
+    finalTags = finalTags.reset_index(drop=True)
+
+    # SUBSET BASED ON TAG
+    implications = finalTags[(finalTags['tag'] == 'implication') & (finalTags['prob'] > .50)].sort_values(by='prob',
+                                                                                                          ascending=False).head(
+        2)
+    implications = implications.sort_values(by='prob', ascending=True)
+
+    results = finalTags[
+        (finalTags['tag'] == 'result') & (finalTags['prob'] > .50) & (finalTags['prob'] < .95)].sort_values(
+        by='prob', ascending=False).head(1)
+
+    methodsHigh = finalTags[(finalTags['tag'] == 'method') & (finalTags['prob'] > .50)].sort_values(by='prob',
+                                                                                                    ascending=False).head(
+        1)
+    methodsLow = finalTags[
+        (finalTags['tag'] == 'method') & (finalTags['prob'] > .40) & (finalTags['prob'] < .46) & (
+            finalTags['sentence'].str.len().between(100, 150))].sort_values(by='prob', ascending=False).head(1)
+
+    methodsAll = [methodsHigh, methodsLow]
+    methods = pd.concat(methodsAll).sort_values(by='prob', ascending=True)
+
+    # MERGE FINAL DF
+    finalHighlightStage = [methods, results, implications]
+    finalHighlights = pd.concat(finalHighlightStage)
+
+    # RETURN 5 HIGHLIGHTS | TOPPED UP WITH THE MOST CONFIDENT SENTENCES WHEN FEWER WERE PICKED ABOVE
+    finalTagsSorted = finalTags.drop(finalHighlights.index).sort_values('prob')
+    finalHighlights = finalHighlights.sentence.tail(5).tolist()
+    if len(finalHighlights) < 5:
+        finalHighlights = finalHighlights + finalTagsSorted.sentence.tail(5 - len(finalHighlights)).tolist()
+
+    return finalHighlights
+
+
+def job_result(tagger, payload):
+    '''Tag `payload['text']` and return its highlights and every tagged sentence, as plain JSON.'''
+    finalTags = tagger.tag(payload['text'], parsed=False, lazy_tense=True)
+    return {'highlights': [str(sentence) for sentence in select_highlights(finalTags)],
+            'sentences': [{'sentence': str(sentence), 'tag': tag, 'prob': float(prob)}
+                          for sentence, tag, prob in zip(finalTags['sentence'], finalTags['tag'], finalTags['prob'])]}
+
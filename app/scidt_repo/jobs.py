@@ -0,0 +1,175 @@
+import json
+import sqlite3
+import threading
+import time
+import uuid
+
+from .process_local import ProcessLocal
+
+
+class JobStore(object):
+    '''Persistent job queue in a sqlite file (WAL mode), shared by every process that opens it.
+
+    Jobs go queued -> running -> done | failed. A running job whose lease has not been renewed
+    (see `renew`) for `lease_seconds`, because its process died, is handed out again, so queued
+    and in-flight work survives restarts.
+    '''
+
+    def __init__(self, path, lease_seconds=600):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self._lock = threading.Lock()
+        self._db = ProcessLocal(self._open)
+
+    def _open(self):
+        db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, status TEXT, payload TEXT, "
+                   "result TEXT, error TEXT, created REAL, updated REAL)")
+        db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created)")
+        return db
+
+    def _connection(self):
+        return self._db.get()
+
+    def submit(self, payload):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._connection().execute("INSERT INTO jobs (id, status, payload, created, updated) VALUES (?, 'queued', ?, ?, ?)",
+                                       (job_id, json.dumps(payload), now, now))
+        return job_id
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._connection().execute("SELECT id, status, result, error, created, updated FROM jobs WHERE id = ?",
+                                             (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = {'id': row[0], 'status': row[1], 'created': row[4], 'updated': row[5]}
+        if row[2] is not None:
+            job['result'] = json.loads(row[2])
+        if row[3] is not None:
+            job['error'] = row[3]
+        return job
+
+    def count(self, status='queued'):
+        with self._lock:
+            return self._connection().execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (status,)).fetchone()[0]
+
+    def claim(self):
+        '''Mark the oldest runnable job as running and return (id, payload), or None if there is none.'''
+        now = time.time()
+        with self._lock:
+            db = self._connection()
+            # BEGIN IMMEDIATE takes the write lock first, so two processes never claim the same job
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                row = db.execute("SELECT id, payload FROM jobs WHERE status = 'queued' "
+                                 "OR (status = 'running' AND updated < ?) ORDER BY created LIMIT 1",
+                                 (now - self.lease_seconds,)).fetchone()
+                if row is not None:
+                    db.execute("UPDATE jobs SET status = 'running', updated = ? WHERE id = ?", (now, row[0]))
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        return row[0], json.loads(row[1])
+
+    def renew(self, job_id):
+        '''Extend the lease of a job this process is still running.'''
+        with self._lock:
+            self._connection().execute("UPDATE jobs SET updated = ? WHERE id = ? AND status = 'running'",
+                                       (time.time(), job_id))
+
+    def _finish(self, job_id, status, result=None, error=None):
+        with self._lock:
+            self._connection().execute("UPDATE jobs SET status = ?, result = ?, error = ?, updated = ? WHERE id = ?",
+                                       (status, None if result is None else json.dumps(result), error,
+                                        time.time(), job_id))
+
+    def finish(self, job_id, result):
+        self._finish(job_id, 'done', result=result)
+
+    def fail(self, job_id, error):
+        self._finish(job_id, 'failed', error=error)
+
+    def purge(self, max_age):
+        '''Delete finished jobs last updated more than `max_age` seconds ago.'''
+        with self._lock:
+            self._connection().execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated < ?",
+                                       (time.time() - max_age,))
+
+
+class JobWorkers(object):
+    '''A fixed pool of threads that run `handler(payload)` for jobs claimed from a `JobStore`.
+
+    Threads are started lazily in the process that uses them (they do not survive a fork).
+    Submissions from this process wake an idle worker at once; work queued by other
+    processes is picked up within `poll_interval` seconds. While a job runs, one more thread
+    renews its lease every third of `store.lease_seconds`, so long jobs are not handed out twice.
+    '''
+
+    def __init__(self, store, handler, num_workers=2, poll_interval=0.5, max_age=24 * 60 * 60):
+        self.store = store
+        self.handler = handler
+        self.num_workers = num_workers
+        self.poll_interval = poll_interval
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._wakeup = ProcessLocal(threading.Event)
+        self._running = ProcessLocal(set)
+        self._threads = []
+        self._renewer = None
+
+    def start(self):
+        with self._lock:
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            while len(self._threads) < self.num_workers:
+                thread = threading.Thread(target=self._run, name='job-worker-%d' % len(self._threads), daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            if self._renewer is None or not self._renewer.is_alive():
+                self._renewer = threading.Thread(target=self._renew, name='job-lease-renewer', daemon=True)
+                self._renewer.start()
+
+    def submit(self, payload):
+        job_id = self.store.submit(payload)
+        self.start()
+        self._wakeup.get().set()
+        return job_id
+
+    def _run(self):
+        wakeup = self._wakeup.get()
+        last_purge = 0
+        while True:
+            job = self.store.claim()
+            if job is None:
+                if time.time() - last_purge > 60 * 60:
+                    self.store.purge(self.max_age)
+                    last_purge = time.time()
+                wakeup.wait(self.poll_interval)
+                wakeup.clear()
+                continue
+            job_id, payload = job
+            with self._lock:
+                self._running.get().add(job_id)
+            try:
+                result = self.handler(payload)
+            except Exception as e:
+                self.store.fail(job_id, '%s: %s' % (type(e).__name__, e))
+            else:
+                self.store.finish(job_id, result)
+            finally:
+                with self._lock:
+                    self._running.get().discard(job_id)
+
+    def _renew(self):
+        while True:
+            time.sleep(self.store.lease_seconds / 3.0)
+            with self._lock:
+                running = list(self._running.get())
+            for job_id in running:
+                self.store.renew(job_id)
@@ -0,0 +1,170 @@
+import json
+
+import numpy as np
+
+
+def sigmoid(x):
+    # tanh form avoids overflow warnings from exp in float32
+    return 0.5 * (1. + np.tanh(0.5 * x))
+
+
+def hard_sigmoid(x):
+    # Keras' piecewise-linear sigmoid
+    return np.clip(0.2 * x + 0.5, 0., 1.)
+
+
+def _softmax(x):
+    e = np.exp(x - np.max(x, axis=-1, keepdims=True))
+    return e / np.sum(e, axis=-1, keepdims=True)
+
+
+# The Keras activations the NumPy inference code reproduces, by their config name. The tagger
+# head, ClauseProjection and CRFDecoder all look activations up here.
+ACTIVATIONS = {'linear': lambda x: x,
+               'tanh': np.tanh,
+               'relu': lambda x: np.maximum(x, 0.),
+               'sigmoid': sigmoid,
+               'hard_sigmoid': hard_sigmoid}
+_RECURRENT_ACTIVATIONS = ('sigmoid', 'hard_sigmoid')
+
+
+class NumpyTagger(object):
+    '''The sentence tagger head (Dense -> LSTM or BiLSTM -> softmax) run in batched float32 NumPy.
+
+    Mirrors a non-attention, non-CRF tagger from `fit_model`: dropout is a no-op at inference,
+    LSTM gates are packed i,f,c,o as in Keras, and with `masking` all-zero clause rows are
+    skipped like the Masking layer of a variable-length tagger. It exposes `predict` and
+    `predict_on_batch`, so `PassageTagger.predict` can use it in place of the Keras model.
+    Weights are taken from a loaded Keras model once (`from_model`) and can be saved to and
+    loaded from an .npz file, which needs no TensorFlow.
+    '''
+
+    def __init__(self, dense_kernel, dense_bias, lstm_weights, output_kernel, output_bias,
+                 recurrent_activation='sigmoid', masking=False, projection_activation='linear'):
+        self.dense_kernel = np.asarray(dense_kernel, dtype=np.float32)
+        self.dense_bias = np.asarray(dense_bias, dtype=np.float32)
+        # one (kernel, recurrent_kernel, bias) triple per direction, forward first
+        self.lstm_weights = [tuple(np.asarray(w, dtype=np.float32) for w in weights) for weights in lstm_weights]
+        self.output_kernel = np.asarray(output_kernel, dtype=np.float32)
+        self.output_bias = np.asarray(output_bias, dtype=np.float32)
+        if recurrent_activation not in _RECURRENT_ACTIVATIONS:
+            raise ValueError("Unsupported recurrent activation: %s" % recurrent_activation)
+        self.recurrent_activation = recurrent_activation
+        if projection_activation not in ACTIVATIONS:
+            raise ValueError("Unsupported projection activation: %s" % projection_activation)
+        self.projection_activation = projection_activation
+        self.masking = masking
+
+    @classmethod
+    def from_model(cls, tagger):
+        '''Copy the weights of a loaded Keras sentence tagger.'''
+        dense = lstm = output = None
+        masking = False
+        for layer in tagger.layers:
+            kind = layer.__class__.__name__
+            if kind in ('InputLayer', 'Dropout'):
+                continue
+            elif kind == 'Masking':
+                masking = True
+            elif kind == 'Dense' and dense is None:
+                dense = layer
+            elif kind in ('Bidirectional', 'LSTM') and lstm is None:
+                lstm = layer
+            elif kind == 'TimeDistributed' and layer.layer.__class__.__name__ == 'Dense':
+                output = layer.layer
+            else:
+                raise ValueError("NumpyTagger can't run a %s layer (%s)" % (kind, layer.name))
+        if dense is None or output is None:
+            raise ValueError("Expected a Dense projection and a TimeDistributed Dense output layer")
+        if output.get_config()['activation'] != 'softmax':
+            raise ValueError("NumpyTagger only supports a softmax output layer, not %s" % output.get_config()['activation'])
+        if lstm is None:
+            lstm_weights, recurrent_activation = [], 'sigmoid'
+        else:
+            cell = lstm.forward_layer if lstm.__class__.__name__ == 'Bidirectional' else lstm
+            if cell.get_config()['activation'] != 'tanh':
+                raise ValueError("NumpyTagger only supports tanh LSTMs")
+            if lstm.__class__.__name__ == 'Bidirectional' and lstm.merge_mode != 'concat':
+                raise ValueError("NumpyTagger only supports merge_mode='concat'")
+            recurrent_activation = cell.get_config()['recurrent_activation']
+            weights = lstm.get_weights()
+            lstm_weights = [weights[i:i + 3] for i in range(0, len(weights), 3)]
+        dense_kernel, dense_bias = dense.get_weights()
+        output_kernel, output_bias = output.get_weights()
+        return cls(dense_kernel, dense_bias, lstm_weights, output_kernel, output_bias,
+                   recurrent_activation=recurrent_activation, masking=masking,
+                   projection_activation=dense.get_config()['activation'])
+
+    @classmethod
+    def from_checkpoint(cls, config_json, weights_file_name, variable_length=False):
+        '''Build from a `model_*_config.json` / `model_*_weights` pair (reading the checkpoint needs TensorFlow).'''
+        from .discourse_tagger_generator_bert2 import load_tagger
+        tagger, _ = load_tagger(config_json, weights_file_name, variable_length=variable_length)
+        return cls.from_model(tagger)
+
+    def save(self, path):
+        arrays = {'dense_kernel': self.dense_kernel, 'dense_bias': self.dense_bias,
+                  'output_kernel': self.output_kernel, 'output_bias': self.output_bias}
+        for i, weights in enumerate(self.lstm_weights):
+            for name, weight in zip(('kernel', 'recurrent_kernel', 'bias'), weights):
+                arrays['lstm_%d_%s' % (i, name)] = weight
+        arrays['config'] = np.array(json.dumps({'recurrent_activation': self.recurrent_activation,
+                                                'projection_activation': self.projection_activation,
+                                                'masking': self.masking,
+                                                'directions': len(self.lstm_weights)}))
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        arrays = np.load(path)
+        config = json.loads(str(arrays['config']))
+        lstm_weights = [[arrays['lstm_%d_%s' % (i, name)] for name in ('kernel', 'recurrent_kernel', 'bias')]
+                        for i in range(config['directions'])]
+        return cls(arrays['dense_kernel'], arrays['dense_bias'], lstm_weights, arrays['output_kernel'],
+                   arrays['output_bias'], recurrent_activation=config['recurrent_activation'],
+                   masking=config['masking'], projection_activation=config.get('projection_activation', 'linear'))
+
+    def _lstm(self, x, mask, kernel, recurrent_kernel, bias, go_backwards=False):
+        batch, steps, _ = x.shape
+        units = recurrent_kernel.shape[0]
+        recurrent_activation = ACTIVATIONS[self.recurrent_activation]
+        # input projections for every step in one matmul
+        input_proj = np.dot(x, kernel) + bias
+        h = np.zeros((batch, units), dtype=np.float32)
+        c = np.zeros((batch, units), dtype=np.float32)
+        outputs = np.zeros((batch, steps, units), dtype=np.float32)
+        order = range(steps - 1, -1, -1) if go_backwards else range(steps)
+        for t in order:
+            z = input_proj[:, t] + np.dot(h, recurrent_kernel)
+            i = recurrent_activation(z[:, :units])
+            f = recurrent_activation(z[:, units:2 * units])
+            new_c = f * c + i * np.tanh(z[:, 2 * units:3 * units])
+            o = recurrent_activation(z[:, 3 * units:])
+            new_h = o * np.tanh(new_c)
+            if mask is None:
+                h, c = new_h, new_c
+            else:
+                # masked steps leave the state untouched, as with the Keras Masking layer
+                real = mask[:, t][:, None]
+                h = np.where(real, new_h, h)
+                c = np.where(real, new_c, c)
+            outputs[:, t] = h
+        return outputs
+
+    def predict_on_batch(self, X):
+        '''Label probabilities (batch, time, labels) for clause embeddings (batch, time, 768).'''
+        X = np.asarray(X, dtype=np.float32)
+        mask = np.any(X != 0, axis=-1) if self.masking else None
+        x = ACTIVATIONS[self.projection_activation](np.dot(X, self.dense_kernel) + self.dense_bias)
+        if self.lstm_weights:
+            directions = [self._lstm(x, mask, *weights, go_backwards=i == 1)
+                          for i, weights in enumerate(self.lstm_weights)]
+            x = np.concatenate(directions, axis=-1)
+        return _softmax(np.dot(x, self.output_kernel) + self.output_bias)
+
+    def predict(self, X, batch_size=32):
+        X = np.asarray(X, dtype=np.float32)
+        if len(X) == 0:
+            return np.zeros((0,) + X.shape[1:-1] + self.output_bias.shape, dtype=np.float32)
+        return np.concatenate([self.predict_on_batch(X[i:i + batch_size]) for i in range(0, len(X), batch_size)])
+
@@ -0,0 +1,26 @@
+import os
+import threading
+
+
+class ProcessLocal(object):
+    '''A value made by `factory()` on first use in each process.
+
+    Connections, threads and queues don't survive a fork: a forked worker that touched its
+    parent's sqlite connection or socket would corrupt it, and the parent's threads are gone.
+    So the value is made again, lazily, the first time `get` runs in a new process.
+    '''
+
+    def __init__(self, factory):
+        self.factory = factory
+        self._lock = threading.Lock()
+        self._value = None
+        self._pid = None
+
+    def get(self):
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    self._value = self.factory()
+                    self._pid = pid
+        return self._value
@@ -0,0 +1,140 @@
+import glob
+import hashlib
+import json
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+
+def normalize_text(text):
+    return ' '.join(text.split())
+
+
+def normalize_content(content):
+    '''Whitespace-normalize every string of a text or a (nested) list of sentences or windows.
+    Each string is normalized on its own, so the list structure (the segmentation) is kept.'''
+    if isinstance(content, str):
+        return normalize_text(content)
+    return [normalize_content(part) for part in content]
+
+
+def weights_checksum(weights_prefix):
+    '''Hash every file of a `model_*_weights` checkpoint (index and data shards).'''
+    digest = hashlib.sha1()
+    for path in sorted(glob.glob(weights_prefix + '*')):
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+class MemoryBackend(object):
+    '''In-process LRU store with per-entry expiry.'''
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires is not None and expires < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires = time.time() + ttl if ttl else None
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class DiskBackend(object):
+    '''One pickle per entry in a local directory; the least recently used files are removed past `max_entries`.'''
+
+    def __init__(self, directory, max_entries=10000):
+        self.directory = directory
+        self.max_entries = max_entries
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.pkl')
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                expires, value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        if expires is not None and expires < time.time():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        os.utime(path)
+        return value
+
+    def set(self, key, value, ttl=None):
+        expires = time.time() + ttl if ttl else None
+        # write then rename, so concurrent readers never see a partial file
+        tmp_path = '%s.%d.tmp' % (self._path(key), os.getpid())
+        with open(tmp_path, 'wb') as f:
+            pickle.dump((expires, value), f)
+        os.replace(tmp_path, self._path(key))
+        self._evict()
+
+    def _evict(self):
+        paths = glob.glob(os.path.join(self.directory, '*.pkl'))
+        if len(paths) <= self.max_entries:
+            return
+        paths.sort(key=lambda path: os.path.getmtime(path) if os.path.exists(path) else 0)
+        for path in paths[:len(paths) - self.max_entries]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+class ResultCache(object):
+    '''Content-addressed cache of tagging results.
+
+    Keys combine the normalized input (a text, or a list of sentences or windows) with the
+    tagger config string (`model_ext`, including every extractor setting that changes the
+    output) and a checksum of its weights, so retraining or switching models never serves
+    stale results.
+    '''
+
+    def __init__(self, model_ext, checksum, backend=None, ttl=None):
+        self.model_ext = model_ext
+        self.checksum = checksum
+        self.backend = backend if backend is not None else MemoryBackend()
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, kind, content):
+        key = json.dumps([self.model_ext, self.checksum, kind, normalize_content(content)])
+        return hashlib.sha256(key.encode('utf8')).hexdigest()
+
+    def get(self, kind, content):
+        value = self.backend.get(self.key(kind, content))
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, kind, content, value):
+        self.backend.set(self.key(kind, content), value, ttl=self.ttl)
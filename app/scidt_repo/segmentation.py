@@ -0,0 +1,48 @@
+"""
+Sentence segmentation and tense with spaCy. Kept apart from extract_highlights so a process can
+load (and share) the pipelines without importing TensorFlow.
+"""
+import spacy
+
+_pipelines = {}
+
+
+def get_nlp(tense=False):
+    """Load (once) the smallest spaCy pipeline a feature needs.
+
+    Sentence boundaries come from the dependency parser, as they did with the full
+    en_core_web_sm pipeline: the sentencizer is added after the parser and does not overwrite
+    its boundaries. Segmentation alone skips the tagger and attribute_ruler, which the parser
+    does not depend on; tense keeps them for morphology. NER and the lemmatizer are never
+    loaded. Both pipelines run the same tok2vec and parser, so they split text the same way.
+    """
+    if tense not in _pipelines:
+        exclude = ["ner", "lemmatizer"] if tense else ["ner", "lemmatizer", "tagger", "attribute_ruler"]
+        nlp = spacy.load("en_core_web_sm", exclude=exclude)
+        nlp.add_pipe("sentencizer", config={"punct_chars": None})
+        _pipelines[tense] = nlp
+    return _pipelines[tense]
+
+
+def segment_many(texts, tense=False, batch_size=64, n_process=1):
+    """Yield the sentence spans of every text, streaming them through `nlp.pipe`."""
+    for doc in get_nlp(tense).pipe(texts, batch_size=batch_size, n_process=n_process):
+        yield list(doc.sents)
+
+
+def root_tense(sent):
+    """Tense of the ROOT token of a parsed sentence (a spaCy Doc or Span), or 'UNK'."""
+    tense = 'UNK'
+    for token in sent:
+        if token.dep_ == 'ROOT':
+            try:
+                tense = token.morph.get('Tense')[0]
+            except IndexError:
+                pass
+    return tense
+
+
+def needs_tense_parse(sent):
+    """Whether `root_tense` can't read `sent` as it is: a plain string, or a span of a doc missing
+    the parse (for the ROOT) or the morphology (for its Tense), like those of `get_nlp(tense=False)`."""
+    return isinstance(sent, str) or not (sent.doc.has_annotation("DEP") and sent.doc.has_annotation("MORPH"))
@@ -0,0 +1,206 @@
+"""
+Standalone inference daemon: one process holds SciBERT and the tagger and serves any number of
+web workers over a Unix domain socket, batching their requests together.
+
+    python -m scidt_repo.sidecar --socket_path /tmp/highlights.sock --bidirectional
+
+Frames are a 4-byte big-endian length followed by that many bytes of UTF-8 JSON. A request is
+    {"op": "tag", "text": "...", "tense": false}          raw text, segmented by the sidecar
+    {"op": "tag", "sentences": ["...", ...], "tense": true}  already segmented
+    {"op": "ping"}
+and the reply to "tag" holds equally long "sentence", "tag", "prob" and "tense" lists
+(tenses are null when not requested), or {"error": "..."}. Connections are kept open across
+requests. The client side needs neither TensorFlow nor spaCy.
+"""
+import argparse
+import json
+import os
+import socket
+import socketserver
+import struct
+import threading
+
+import pandas as pd
+
+from .batching import MicroBatcher
+from .process_local import ProcessLocal
+
+_HEADER = struct.Struct('>I')
+MAX_FRAME_BYTES = 64 * 1024 * 1024
+
+
+def _read_exactly(stream, size):
+    data = b''
+    while len(data) < size:
+        chunk = stream.read(size - len(data)) if hasattr(stream, 'read') else stream.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+def read_frame(stream):
+    '''Next JSON message from a file-like object or socket, or None once the peer has closed it.'''
+    header = _read_exactly(stream, _HEADER.size)
+    if header is None:
+        return None
+    (size,) = _HEADER.unpack(header)
+    if size > MAX_FRAME_BYTES:
+        raise ValueError("Frame of %d bytes is larger than %d" % (size, MAX_FRAME_BYTES))
+    payload = _read_exactly(stream, size)
+    if payload is None:
+        return None
+    return json.loads(payload.decode('utf8'))
+
+
+def encode_frame(message):
+    payload = json.dumps(message).encode('utf8')
+    return _HEADER.pack(len(payload)) + payload
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        while True:
+            try:
+                request = read_frame(self.rfile)
+            except ValueError as e:
+                self.wfile.write(encode_frame({'error': str(e)}))
+                return
+            if request is None:
+                return
+            try:
+                response = self.server.dispatch(request)
+            except Exception as e:
+                response = {'error': '%s: %s' % (type(e).__name__, e)}
+            self.wfile.write(encode_frame(response))
+            self.wfile.flush()
+
+
+class SidecarServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    '''Serve a `HighlightExtractor` on a Unix socket; one thread per client connection, and a
+    shared `MicroBatcher` so passages from different clients run through the model together.'''
+    daemon_threads = True
+
+    def __init__(self, socket_path, extractor, max_wait_ms=10, max_sentences=300):
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        self.extractor = extractor
+        self.batcher = MicroBatcher(extractor, max_wait_ms=max_wait_ms, max_sentences=max_sentences)
+        self.ready = threading.Event()
+        socketserver.UnixStreamServer.__init__(self, socket_path, _Handler)
+
+    def warmup(self):
+        self.extractor.warmup()
+        self.ready.set()
+
+    def dispatch(self, request):
+        op = request.get('op', 'tag')
+        if op == 'ping':
+            return {'ready': self.ready.is_set()}
+        if op != 'tag':
+            raise ValueError("Unknown op: %s" % op)
+        lazy_tense = not request.get('tense', False)
+        if 'sentences' in request:
+            df = self.batcher.tag(request['sentences'], parsed=True, lazy_tense=lazy_tense)
+        else:
+            df = self.batcher.tag(request['text'], parsed=False, lazy_tense=lazy_tense)
+        return {'sentence': [str(sentence) for sentence in df['sentence']],
+                'tag': list(df['tag']),
+                'prob': [float(prob) for prob in df['prob']],
+                'tense': [None if pd.isna(tense) else tense for tense in df['tense']]}
+
+
+class SidecarClient(object):
+    '''Talk to a `SidecarServer`. Each thread (and each forked process) keeps its own connection.'''
+
+    def __init__(self, socket_path, timeout=None):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._local = ProcessLocal(threading.local)
+
+    def _connection(self):
+        local = self._local.get()
+        conn = getattr(local, 'conn', None)
+        if conn is None:
+            conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            conn.settimeout(self.timeout)
+            conn.connect(self.socket_path)
+            local.conn = conn
+        return conn
+
+    def _close(self):
+        local = self._local.get()
+        conn = getattr(local, 'conn', None)
+        local.conn = None
+        if conn is not None:
+            conn.close()
+
+    def request(self, message):
+        frame = encode_frame(message)
+        # a kept-alive connection may have been dropped by a sidecar restart; reconnect once
+        for attempt in range(2):
+            try:
+                conn = self._connection()
+                conn.sendall(frame)
+                response = read_frame(conn)
+                if response is None:
+                    raise ConnectionError("Inference sidecar closed the connection")
+                break
+            except (ConnectionError, BrokenPipeError):
+                self._close()
+                if attempt == 1:
+                    raise
+        if 'error' in response:
+            raise RuntimeError(response['error'])
+        return response
+
+    def ready(self):
+        try:
+            return self.request({'op': 'ping'})['ready']
+        except (OSError, RuntimeError):
+            return False
+
+    def tag(self, text_or_sentences, parsed=False, lazy_tense=False):
+        '''Same columns as `HighlightExtractor.tag`, computed by the sidecar.'''
+        message = {'op': 'tag', 'tense': not lazy_tense}
+        if parsed:
+            message['sentences'] = [str(sentence) for sentence in text_or_sentences]
+        else:
+            message['text'] = text_or_sentences
+        return pd.DataFrame(self.request(message), columns=['sentence', 'tag', 'prob', 'tense'])
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description="Serve highlight tagging over a Unix domain socket")
+    argparser.add_argument('--socket_path', type=str, help="Unix socket to listen on")
+    argparser.set_defaults(socket_path='/tmp/highlights.sock')
+    argparser.add_argument('--scibert_path', type=str, help="SciBERT checkpoint directory")
+    argparser.set_defaults(scibert_path='models/scibert_scivocab_uncased')
+    argparser.add_argument('--tagger_path', type=str, help="Directory with the model_* tagger files")
+    argparser.set_defaults(tagger_path='models/tagger')
+    argparser.add_argument('--use_attention', help="Use attention over words? Or else will average their representations", action='store_true')
+    argparser.add_argument('--lstm', help="Sentence level LSTM", action='store_true')
+    argparser.add_argument('--bidirectional', help="Bidirectional LSTM", action='store_true')
+    argparser.add_argument('--crf', help="Conditional Random Field", action='store_true')
+    argparser.add_argument('--batch_wait_ms', type=float, help="How long a batch waits for more requests")
+    argparser.set_defaults(batch_wait_ms=10)
+    argparser.add_argument('--batch_max_sentences', type=int, help="Run a batch early once it has this many sentences")
+    argparser.set_defaults(batch_max_sentences=300)
+    argparser.add_argument('--embedding_cache_path', type=str, help="sqlite file for cached sentence vectors")
+    argparser.add_argument('--result_cache_size', type=int, help="Number of tagged documents kept in memory")
+    argparser.set_defaults(result_cache_size=256)
+    args = argparser.parse_args()
+
+    # only the daemon needs the models (and TensorFlow)
+    from .extract_highlights import HighlightExtractor
+    from .result_cache import MemoryBackend
+    extractor = HighlightExtractor(args.scibert_path, args.tagger_path, use_attention=args.use_attention,
+                                   lstm=args.lstm, bidirectional=args.bidirectional, crf=args.crf,
+                                   embedding_cache_path=args.embedding_cache_path,
+                                   result_cache_backend=MemoryBackend(max_entries=args.result_cache_size),
+                                   numpy_head=True, compiled=True)
+    server = SidecarServer(args.socket_path, extractor, max_wait_ms=args.batch_wait_ms,
+                           max_sentences=args.batch_max_sentences)
+    threading.Thread(target=server.warmup, name='warmup', daemon=True).start()
+    print("Listening on", args.socket_path)
+    server.serve_forever()
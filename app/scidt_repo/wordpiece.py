@@ -0,0 +1,149 @@
+import functools
+import unicodedata
+
+import numpy as np
+
+_TERMINAL = None
+
+
+def _is_punctuation(ch):
+    code = ord(ch)
+    return 33 <= code <= 47 or 58 <= code <= 64 or 91 <= code <= 96 or 123 <= code <= 126 or \
+        unicodedata.category(ch).startswith('P')
+
+
+def _is_cjk_character(ch):
+    code = ord(ch)
+    return 0x4E00 <= code <= 0x9FFF or 0x3400 <= code <= 0x4DBF or 0x20000 <= code <= 0x2A6DF or \
+        0x2A700 <= code <= 0x2B73F or 0x2B740 <= code <= 0x2B81F or 0x2B820 <= code <= 0x2CEAF or \
+        0xF900 <= code <= 0xFAFF or 0x2F800 <= code <= 0x2FA1F
+
+
+class _SpacingTable(dict):
+    '''`str.translate` table giving every character the treatment `keras_bert.Tokenizer._tokenize`
+    gives it: punctuation and CJK characters are spaced out, whitespace becomes a space, control
+    characters are dropped. Entries are worked out the first time a character is seen.'''
+
+    def __missing__(self, code):
+        ch = chr(code)
+        if _is_punctuation(ch) or _is_cjk_character(ch):
+            value = ' ' + ch + ' '
+        elif ch in ' \n\r\t' or unicodedata.category(ch) == 'Zs':
+            value = ' '
+        elif code == 0 or code == 0xfffd or unicodedata.category(ch) in ('Cc', 'Cf'):
+            value = None
+        else:
+            value = ch
+        self[code] = value
+        return value
+
+
+def _build_trie(tokens):
+    root = {}
+    for token, index in tokens:
+        node = root
+        for ch in token:
+            node = node.setdefault(ch, {})
+        node[_TERMINAL] = index
+    return root
+
+
+class FastTokenizer(object):
+    '''Drop-in replacement for `keras_bert.Tokenizer` (uncased) built for bulk tokenization.
+
+    The vocabulary is compiled into two character tries, one for word-initial pieces and one
+    for `##` continuations, so the greedy longest-match WordPiece split walks each word once
+    instead of trying every substring. Word -> wordpiece ids is memoized in a bounded LRU,
+    which pays off on scientific text where the same words keep coming back. `encode` returns
+    exactly what `keras_bert.Tokenizer.encode` does for a single text, including its habit of
+    giving every unmatched character its own [UNK]; `batch_encode` does many texts at once.
+    '''
+
+    def __init__(self, token_dict, token_cls='[CLS]', token_sep='[SEP]', token_unk='[UNK]', pad_index=0,
+                 memo_size=200000):
+        self._token_dict = token_dict
+        self._token_dict_inv = {v: k for k, v in token_dict.items()}
+        self._token_cls = token_cls
+        self._token_sep = token_sep
+        self._token_unk = token_unk
+        self._cls_id = token_dict.get(token_cls)
+        self._sep_id = token_dict.get(token_sep)
+        self._unk_id = token_dict.get(token_unk)
+        self._pad_index = pad_index
+        self._spacing = _SpacingTable()
+        self._initial = _build_trie((token, index) for token, index in token_dict.items()
+                                    if not token.startswith('##'))
+        self._continuation = _build_trie((token[2:], index) for token, index in token_dict.items()
+                                         if token.startswith('##'))
+        self._word_ids = functools.lru_cache(maxsize=memo_size)(self._word_piece_ids)
+
+    def _words(self, text):
+        if not text.isascii():
+            text = unicodedata.normalize('NFD', text)
+            text = ''.join([ch for ch in text if unicodedata.category(ch) != 'Mn'])
+        return text.lower().translate(self._spacing).split()
+
+    def _word_piece_ids(self, word):
+        ids = []
+        start = 0
+        trie = self._initial
+        while start < len(word):
+            node = trie
+            match, match_end = None, start
+            for end in range(start, len(word)):
+                node = node.get(word[end])
+                if node is None:
+                    break
+                if _TERMINAL in node:
+                    match, match_end = node[_TERMINAL], end + 1
+            if match is None:
+                # no piece starts with this character: it becomes an [UNK] on its own
+                ids.append(self._unk_id)
+                start += 1
+            else:
+                ids.append(match)
+                start = match_end
+            trie = self._continuation
+        return tuple(ids)
+
+    def _ids(self, text):
+        ids = []
+        for word in self._words(text):
+            ids.extend(self._word_ids(word))
+        return ids
+
+    def tokenize(self, first):
+        '''Wordpiece tokens with [CLS] and [SEP]. Unknown pieces come back as [UNK].'''
+        return [self._token_cls] + [self._token_dict_inv.get(i, self._token_unk) for i in self._ids(first)] + \
+            [self._token_sep]
+
+    def encode(self, first, max_len=None):
+        ids = self._ids(first)
+        if max_len is not None:
+            del ids[max_len - 2:]
+        token_ids = [self._cls_id] + ids + [self._sep_id]
+        segment_ids = [0] * len(token_ids)
+        if max_len is not None:
+            pad_len = max_len - len(token_ids)
+            token_ids += [self._pad_index] * pad_len
+            segment_ids += [0] * pad_len
+        return token_ids, segment_ids
+
+    def batch_encode(self, texts, max_len=None):
+        '''Token ids of every text as a ragged list of int32 arrays, [CLS] and [SEP] included.
+        Texts longer than `max_len` tokens are truncated like `encode` does, but nothing is padded.'''
+        encoded = []
+        for text in texts:
+            ids = self._ids(text)
+            if max_len is not None:
+                del ids[max_len - 2:]
+            row = np.empty(len(ids) + 2, dtype=np.int32)
+            row[0] = self._cls_id
+            row[1:-1] = ids
+            row[-1] = self._sep_id
+            encoded.append(row)
+        return encoded
+
+    def memo_info(self):
+        return self._word_ids.cache_info()
+
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+# TensorAttention is a layer for the standalone Keras 2 API (keras.engine.topology)
+pytest.importorskip("keras.engine.topology")
+
+from keras.layers import Input
+from keras.models import Model
+
+from scidt_repo.attention import TensorAttention
+from scidt_repo.numpy_tagger import hard_sigmoid
+
+
+def _reference_lstm(x, kernel, recurrent_kernel, bias):
+    # the per-gate step TensorAttention used before the gates were fused: eight matmuls per timestep
+    r = recurrent_kernel.shape[0]
+    gate = lambda w, k: w[..., k * r:(k + 1) * r]
+    h = np.zeros((x.shape[0], x.shape[2], r))
+    c = np.zeros((x.shape[0], x.shape[2], r))
+    outputs = []
+    for t in range(x.shape[1]):
+        x_t = x[:, t]
+        i = hard_sigmoid(x_t.dot(gate(kernel, 0)) + gate(bias, 0) + h.dot(gate(recurrent_kernel, 0)))
+        f = hard_sigmoid(x_t.dot(gate(kernel, 1)) + gate(bias, 1) + h.dot(gate(recurrent_kernel, 1)))
+        c = f * c + i * np.tanh(x_t.dot(gate(kernel, 2)) + gate(bias, 2) + h.dot(gate(recurrent_kernel, 2)))
+        o = hard_sigmoid(x_t.dot(gate(kernel, 3)) + gate(bias, 3) + h.dot(gate(recurrent_kernel, 3)))
+        h = o * np.tanh(c)
+        outputs.append(h)
+    return np.stack(outputs, axis=1)
+
+
+def _reference_attention(X, weights, context):
+    proj_input = np.tanh(X.dot(weights[0])).transpose(0, 2, 1, 3) # (sample,w,c,p)
+    if context == 'LSTM_clause':
+        all_rnn_out = _reference_lstm(proj_input, *weights[2:5])
+    else:
+        all_rnn_out = np.concatenate([_reference_lstm(proj_input, *weights[2:5]),
+                                      _reference_lstm(proj_input[:, ::-1], *weights[5:8])], axis=-1)
+    raw_att_scores = all_rnn_out.transpose(0, 2, 1, 3).dot(weights[1]) # (sample,c,w)
+    att_scores = np.exp(raw_att_scores - raw_att_scores.max(axis=2, keepdims=True))
+    att_scores /= att_scores.sum(axis=2, keepdims=True)
+    return np.einsum('scw,scwd->scd', att_scores, X)
+
+
+@pytest.mark.parametrize("context", ['LSTM_clause', 'biLSTM_clause'])
+def test_fused_gates_match_per_gate_lstm(context):
+    np.random.seed(0)
+    c, w, d = 5, 7, 12
+    X = np.random.randn(3, c, w, d).astype("float32")
+    inputs = Input(shape=(c, w, d))
+    layer = TensorAttention((c, w, d), context=context, proj_dim=8, rec_hid_dim=6)
+    model = Model(inputs=inputs, outputs=layer(inputs))
+    # random biases too, so every gate slice is exercised
+    layer.set_weights([np.random.randn(*weight.shape).astype("float32") * 0.5 for weight in layer.get_weights()])
+    expected = _reference_attention(X.astype("float64"), layer.get_weights(), context)
+    assert np.abs(model.predict(X) - expected).max() < 1e-4
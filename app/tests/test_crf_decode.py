@@ -0,0 +1,87 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from scidt_repo.crf_decode import CRFDecoder
+
+features, units, steps = 6, 4, 5
+
+
+def random_decoder(activation='linear'):
+    return CRFDecoder(np.random.randn(features, units), np.random.randn(units, units), np.random.randn(units),
+                      np.random.randn(units), np.random.randn(units), activation=activation)
+
+
+def left_padded_batch(lengths):
+    X = np.random.randn(len(lengths), steps, features)
+    mask = np.arange(steps)[None, :] >= steps - np.asarray(lengths)[:, None]
+    X[~mask] = 0.
+    return X, mask
+
+
+def brute_force_path(decoder, X):
+    # the lowest-energy path of one unpadded, masked sequence: its start energy counts, its end energy
+    # is masked out (see `CRFDecoder.input_energy`)
+    energy = decoder.input_energy(X[None], np.ones((1, len(X))))[0]
+    paths = list(itertools.product(range(decoder.units), repeat=len(X)))
+    energies = [sum(energy[t, y] for t, y in enumerate(path)) +
+                sum(decoder.chain_kernel[a, b] for a, b in zip(path[:-1], path[1:])) for path in paths]
+    return np.array(paths[int(np.argmin(energies))])
+
+
+def test_masked_viterbi_matches_exhaustive_enumeration():
+    np.random.seed(0)
+    decoder = random_decoder()
+    lengths = [5, 3, 1]
+    X, mask = left_padded_batch(lengths)
+    paths = decoder.viterbi(X, mask)
+    for i, length in enumerate(lengths):
+        np.testing.assert_array_equal(paths[i, -length:], brute_force_path(decoder, X[i, -length:]))
+
+
+def test_masked_passages_ignore_their_padding():
+    np.random.seed(1)
+    decoder = random_decoder('tanh')
+    X, mask = left_padded_batch([5, 3, 1])
+    paths, marginals = decoder.decode(X, mask)
+    for i, length in enumerate([5, 3, 1]):
+        alone = X[i:i + 1, -length:]
+        path, marginal = decoder.decode(alone, np.ones((1, length), dtype=bool))
+        np.testing.assert_array_equal(paths[i, -length:], path[0])
+        np.testing.assert_allclose(marginals[i, -length:], marginal[0], atol=1e-12)
+
+
+def test_unmasked_decoding_reads_the_padding():
+    # a tagger without masking runs the CRF over the whole left-padded passage, boundaries at its ends
+    np.random.seed(2)
+    decoder = random_decoder()
+    X, _ = left_padded_batch([2])
+    unpadded = decoder.marginals(X[:, -2:])
+    padded = decoder.marginals(X)
+    assert not np.allclose(padded[:, -2:], unpadded)
+    np.testing.assert_allclose(padded.sum(axis=-1), 1.)
+
+
+@pytest.mark.parametrize("masked", [False, True])
+def test_matches_crf_layer(masked):
+    # CRF is a layer for the standalone Keras 2 API (keras.engine)
+    pytest.importorskip("keras.engine")
+    from keras.layers import Input, Masking
+    from keras.models import Model
+    from scidt_repo.crf import CRF
+
+    np.random.seed(3)
+    X, mask = left_padded_batch([5, 3, 1, 4])
+    outputs = {}
+    for test_mode in ('viterbi', 'marginal'):
+        inputs = Input(shape=(steps, features))
+        x = Masking(mask_value=0.)(inputs) if masked else inputs
+        crf = CRF(units, learn_mode='join', test_mode=test_mode)
+        model = Model(inputs=inputs, outputs=crf(x))
+        crf.set_weights([np.random.RandomState(4).randn(*w.shape) for w in crf.get_weights()])
+        outputs[test_mode] = model.predict(X)
+    decoder = CRFDecoder.from_layer(crf)
+    paths, marginals = decoder.decode(X, mask if masked else None)
+    np.testing.assert_array_equal(paths, outputs['viterbi'].argmax(axis=-1))
+    np.testing.assert_allclose(marginals, outputs['marginal'], atol=1e-5)
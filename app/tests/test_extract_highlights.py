@@ -0,0 +1,22 @@
+import pytest
+
+# needs keras_bert and the Keras 2 layers the tagger modules import (crf, attention)
+extract_highlights = pytest.importorskip("scidt_repo.extract_highlights")
+
+
+def bare_extractor():
+    # everything `tag` reads before it reaches the model; no checkpoint is loaded
+    extractor = extract_highlights.HighlightExtractor.__new__(extract_highlights.HighlightExtractor)
+    extractor.result_cache = None
+    extractor.window_size = 4
+    extractor.window_stride = 2
+    return extractor
+
+
+def test_document_without_sentences_gives_an_empty_frame():
+    def tag_passages(passages):
+        raise AssertionError("an empty document reached the model")
+
+    df = bare_extractor().tag([], parsed=True, tag_passages=tag_passages)
+    assert len(df) == 0
+    assert list(df.columns) == ['sentence', 'tag', 'prob', 'tense']
@@ -0,0 +1,60 @@
+import numpy as np
+
+from scidt_repo.generator import BertDiscourseGenerator, CachedDiscourseGenerator
+from scidt_repo.wordpiece import FastTokenizer
+
+VOCAB = ['[PAD]', '[UNK]', '[CLS]', '[SEP]', 'word', 'another', 'sentence', '.']
+
+
+class FakeInput(object):
+    shape = (None, None)
+
+
+class CountingEncoder(object):
+    '''Token states (attention models) or CLS vectors made from the token ids; counts the clauses it encodes.'''
+    inputs = [FakeInput()]
+
+    def __init__(self, cls_only=False):
+        self.cls_only = cls_only
+        self.encoded = 0
+
+    def predict(self, inputs, batch_size=None):
+        token_ids, _ = inputs
+        self.encoded += len(token_ids)
+        states = np.tanh(token_ids[:, :, None] * np.linspace(.1, 1., 768)[None, None, :] / 10.)
+        return states[:, 0] if self.cls_only else states
+
+
+def overlapping_windows():
+    # windows of one document, as `sliding_windows` makes them: every sentence is in two of them
+    sentences = ['word %s .' % ' '.join(['another'] * i) for i in range(6)]
+    return [sentences[start:start + 4] for start in (0, 2)] + [sentences[2:]]
+
+
+def generator(encoder, use_attention, memoize_clauses):
+    tokenizer = FastTokenizer({token: i for i, token in enumerate(VOCAB)})
+    return BertDiscourseGenerator(encoder, tokenizer, overlapping_windows(), [[]] * 3, {'none': 0}, 1, use_attention,
+                                  4, 5 if use_attention else None, False, memoize_clauses=memoize_clauses)
+
+
+def test_memoized_clauses_are_encoded_once_per_generator():
+    for use_attention in (True, False):
+        plain_encoder, memo_encoder = CountingEncoder(not use_attention), CountingEncoder(not use_attention)
+        plain = generator(plain_encoder, use_attention, memoize_clauses=False)
+        memoized = generator(memo_encoder, use_attention, memoize_clauses=True)
+        for i in range(len(plain)):
+            np.testing.assert_array_equal(memoized[i][0], plain[i][0])
+        assert plain_encoder.encoded == 12
+        assert memo_encoder.encoded == 6
+
+
+def test_cached_generator_serves_the_encoded_batches():
+    windows = overlapping_windows()
+    encoded = generator(CountingEncoder(cls_only=True), False, memoize_clauses=False)
+    features = encoded.encode_clauses([clause for window in windows for clause in window])
+    cached = CachedDiscourseGenerator(features, windows, [[]] * 3, {'none': 0}, 1, False, 4, None, False,
+                                      variable_length=True)
+    for i in range(len(encoded)):
+        np.testing.assert_array_equal(cached[i][0], encoded[i][0])
+    assert cached.batch_seqlen([2, 3]) == 3
+    assert cached.padding_waste() == (0.0, 0.0)
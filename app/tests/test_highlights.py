@@ -0,0 +1,63 @@
+import os
+import time
+
+import pandas as pd
+import pytest
+
+from scidt_repo.highlights import job_result, select_highlights
+from scidt_repo.jobs import JobStore, JobWorkers
+
+
+class FakeTagger(object):
+    '''Stands in for HighlightExtractor: `text` is the number of sentences that pass the tag/probability filters.'''
+
+    def tag(self, text, parsed=False, lazy_tense=False):
+        num_picked = int(text)
+        picked = [('implication', .9), ('implication', .8), ('result', .7), ('method', .6), ('method', .43)]
+        rows = [('Picked sentence %d%s.' % (i, ' padded' * 20 if tag == 'method' and prob < .5 else ''), tag, prob)
+                for i, (tag, prob) in enumerate(picked[:num_picked])]
+        rows += [('Other sentence %d.' % i, 'none', .3 + .01 * i) for i in range(8)]
+        return pd.DataFrame(rows, columns=['sentence', 'tag', 'prob']).assign(tense=None)
+
+
+def wait_for(store, job_ids, timeout=10):
+    deadline = time.time() + timeout
+    while any(store.get(job_id)['status'] in ('queued', 'running') for job_id in job_ids):
+        assert time.time() < deadline, "jobs did not finish"
+        time.sleep(0.05)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(os.path.join(str(tmp_path), 'jobs.sqlite'), lease_seconds=0.6)
+
+
+def test_jobs_return_five_highlights(store):
+    tagger = FakeTagger()
+    workers = JobWorkers(store, lambda payload: job_result(tagger, payload), poll_interval=0.05)
+    job_ids = {num_picked: workers.submit({'text': str(num_picked)}) for num_picked in range(6)}
+    wait_for(store, job_ids.values())
+    for num_picked, job_id in job_ids.items():
+        job = store.get(job_id)
+        assert job['status'] == 'done', job
+        highlights = job['result']['highlights']
+        assert len(set(highlights)) == 5, highlights
+        assert sum(h.startswith('Picked') for h in highlights) >= num_picked, highlights
+
+
+def test_top_up_skips_sentences_already_picked():
+    # the picked implications are also the most probable sentences, and the windows repeat index labels
+    finalTags = pd.concat([FakeTagger().tag('2'), FakeTagger().tag('0').head(1)])
+    highlights = select_highlights(finalTags)
+    assert highlights[:2] == ['Picked sentence 1.', 'Picked sentence 0.']
+    assert highlights[2:] == ['Other sentence 5.', 'Other sentence 6.', 'Other sentence 7.']
+
+
+def test_running_jobs_keep_their_lease(store):
+    # a job that outlives its lease keeps it, because its worker renews it
+    slow = JobWorkers(store, lambda payload: time.sleep(2) or {}, num_workers=1, poll_interval=0.05)
+    job_id = slow.submit({})
+    time.sleep(1.5)
+    assert store.get(job_id)['status'] == 'running'
+    assert JobStore(store.path, lease_seconds=0.6).claim() is None, "a renewed lease was handed out again"
+    wait_for(store, [job_id])
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+from tensorflow.keras.layers import Input, LSTM, Dense, Dropout, TimeDistributed, Bidirectional, Masking
+from tensorflow.keras.models import Model
+
+from scidt_repo.numpy_tagger import NumpyTagger
+
+input_size, proj_dim, lstm_dim, num_classes, steps = 32, 16, 12, 5, 9
+
+
+def build_tagger(variable_length, activation):
+    # built like `fit_model` builds the production sentence tagger
+    inputs = Input(shape=(None if variable_length else steps, input_size))
+    x = Masking(mask_value=0.)(inputs) if variable_length else inputs
+    x = Dropout(0.4)(x)
+    x = Dense(proj_dim, activation=activation)(x)
+    x = Bidirectional(LSTM(lstm_dim, return_sequences=True))(x)
+    x = Dropout(0.5)(x)
+    tagger = Model(inputs=inputs, outputs=TimeDistributed(Dense(num_classes, activation='softmax'))(x))
+    tagger.set_weights([np.random.randn(*w.shape).astype("float32") * 0.3 for w in tagger.get_weights()])
+    return tagger
+
+
+def left_padded_batch():
+    X = np.random.randn(4, steps, input_size).astype("float32")
+    X[1, :3] = 0.
+    X[2, :6] = 0.
+    return X
+
+
+@pytest.mark.parametrize("variable_length,activation", [(False, None), (True, 'tanh')])
+def test_matches_keras(variable_length, activation):
+    np.random.seed(0)
+    tagger = build_tagger(variable_length, activation)
+    X = left_padded_batch()
+    expected = tagger.predict(X, verbose=0)
+    actual = NumpyTagger.from_model(tagger).predict(X)
+    # a masked tagger's outputs at padded steps are never read
+    real = np.any(X != 0, axis=-1) if variable_length else np.ones(X.shape[:2], dtype=bool)
+    assert np.abs(expected - actual)[real].max() < 1e-4
+
+
+def test_save_and_load(tmp_path):
+    np.random.seed(1)
+    engine = NumpyTagger.from_model(build_tagger(True, 'relu'))
+    path = str(tmp_path / "tagger.npz")
+    engine.save(path)
+    X = left_padded_batch()
+    np.testing.assert_array_equal(NumpyTagger.load(path).predict(X), engine.predict(X))
+
+
+def test_refuses_unsupported_projection():
+    inputs = Input(shape=(steps, input_size))
+    x = Dense(proj_dim, activation='elu')(inputs)
+    tagger = Model(inputs=inputs, outputs=TimeDistributed(Dense(num_classes, activation='softmax'))(x))
+    with pytest.raises(ValueError):
+        NumpyTagger.from_model(tagger)
+
+
+def test_refuses_non_softmax_output():
+    inputs = Input(shape=(steps, input_size))
+    x = Dense(proj_dim)(inputs)
+    tagger = Model(inputs=inputs, outputs=TimeDistributed(Dense(num_classes, activation='sigmoid'))(x))
+    with pytest.raises(ValueError):
+        NumpyTagger.from_model(tagger)
@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+# needs keras_bert and the Keras 2 layers the module imports (crf, attention)
+bert2 = pytest.importorskip("scidt_repo.discourse_tagger_generator_bert2")
+
+from tensorflow.keras.layers import Input, Masking, Dense, TimeDistributed
+from tensorflow.keras.models import Model
+
+from scidt_repo.wordpiece import FastTokenizer
+
+VOCAB = ['[PAD]', '[UNK]', '[CLS]', '[SEP]', 'word', 'another', 'sentence', '.']
+
+
+class FakeInput(object):
+    shape = (None, None)
+
+
+class FakeEncoder(object):
+    '''A CLS-only encoder with a free sequence length: every clause gets a vector from its token ids.'''
+    inputs = [FakeInput()]
+
+    def predict(self, inputs, batch_size=None):
+        token_ids, _ = inputs
+        return np.tanh(np.outer(token_ids.sum(axis=1), np.linspace(.1, 1., 768)) / 50.).astype(np.float32)
+
+
+def sentence_tagger(label_ind):
+    # a variable-length tagger, whose input shape records no passage length
+    inputs = Input(shape=(None, 768))
+    x = Masking(mask_value=0.)(inputs)
+    return Model(inputs=inputs, outputs=TimeDistributed(Dense(len(label_ind), activation='softmax'))(x))
+
+
+def passage_tagger(maxseqlen):
+    nnt = bert2.PassageTagger.__new__(bert2.PassageTagger)
+    nnt.params = {'use_attention': False, 'batch_size': 10, 'maxseqlen': maxseqlen, 'maxclauselen': None,
+                  'variable_length': True, 'max_clause_tokens': 512, 'encoder_batch_size': 64}
+    nnt.input_size = 768
+    nnt.maxseqlen = None
+    nnt.maxclauselen = None
+    nnt.embedding_cache = None
+    nnt.feature_store = None
+    nnt.clause_projection = None
+    nnt.encoder = FakeEncoder()
+    nnt.tokenizer = FastTokenizer({token: i for i, token in enumerate(VOCAB)})
+    return nnt
+
+
+def test_document_longer_than_warmup_passage_is_tagged_whole():
+    label_ind = {'none': 0, 'B_result': 1, 'I_result': 2}
+    nnt = passage_tagger(maxseqlen=8)
+    nnt.tagger = sentence_tagger(label_ind)
+    # warmup tags a one-sentence passage first
+    lengths, generator = nnt.make_data_from_sequences([['word .']], label_ind=label_ind, train=False)
+    nnt.predict(generator, lengths)
+    document = [['word %s .' % ' '.join(['another'] * i) for i in range(6)]]
+    lengths, generator = nnt.make_data_from_sequences(document, label_ind=label_ind, train=False)
+    assert nnt.maxseqlen == 8
+    batch_X, _ = generator[0]
+    # every sentence reaches the tagger, none is cut off and labeled "none"
+    assert batch_X.shape == (1, 6, 768)
+    assert np.all(np.any(batch_X[0] != 0, axis=-1))
+
+
+def test_inference_needs_the_trained_passage_length():
+    nnt = passage_tagger(maxseqlen=None)
+    with pytest.raises(ValueError):
+        nnt.make_data_from_sequences([['word .']], label_ind={'none': 0}, train=False)
+
+
+def test_variable_length_checkpoint_records_its_passage_length(tmp_path):
+    label_ind = {'none': 0, 'B_result': 1}
+    tagger = sentence_tagger(label_ind)
+    weights = str(tmp_path / 'model.weights.h5')
+    tagger.save_weights(weights)
+    _, saved_seqlen = bert2.load_tagger(bert2.tagger_config_json(tagger, 12), weights)
+    assert saved_seqlen == 12
@@ -0,0 +1,26 @@
+import spacy
+from spacy.tokens import Doc
+
+from scidt_repo.segmentation import needs_tense_parse, root_tense
+
+WORDS = ['The', 'model', 'improved', 'recall', '.']
+HEADS = [1, 2, 2, 2, 2]
+DEPS = ['det', 'nsubj', 'ROOT', 'dobj', 'punct']
+MORPHS = ['', 'Number=Sing', 'Tense=Past|VerbForm=Fin', 'Number=Sing', '']
+
+
+def sentence(**annotations):
+    return Doc(spacy.blank('en').vocab, words=WORDS, **annotations)[:]
+
+
+def test_spans_with_parse_and_morphology_are_read_as_they_are():
+    sent = sentence(heads=HEADS, deps=DEPS, morphs=MORPHS)
+    assert not needs_tense_parse(sent)
+    assert root_tense(sent) == 'Past'
+
+
+def test_spans_from_the_segmentation_pipeline_are_parsed_again():
+    # get_nlp(tense=False) parses but skips the tagger and attribute_ruler, so there is no morphology
+    assert needs_tense_parse(sentence(heads=HEADS, deps=DEPS))
+    assert needs_tense_parse(sentence(morphs=MORPHS))
+    assert needs_tense_parse(' '.join(WORDS))
@@ -0,0 +1,47 @@
+import codecs
+import os
+
+import pytest
+
+from scidt_repo.wordpiece import FastTokenizer
+
+VOCAB_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                          'models', 'scibert_scivocab_uncased', 'vocab.txt')
+
+TEXTS = ["The ligand-binding affinity (K_d = 3.2 nM) was measured at 37°C.",
+         "Naïve Bézier curves, α-helices and Ångström-scale features overlap.",
+         "Tabs\tand\nnewlines\r\x0bcontrol\x00chars � and 中文 CJK text.",
+         "zzzqxjv unmatchable ☃☃ snowmen İstanbul [CLS] ##ing",
+         "   ", ""]
+
+
+@pytest.fixture(scope='module')
+def token_dict():
+    if not os.path.exists(VOCAB_PATH):
+        pytest.skip("SciBERT vocabulary not found at %s" % VOCAB_PATH)
+    token_dict = {}
+    with codecs.open(VOCAB_PATH, 'r', 'utf8') as reader:
+        for line in reader:
+            token = line.strip()
+            token_dict[token] = len(token_dict)
+    return token_dict
+
+
+@pytest.mark.parametrize("text", TEXTS)
+def test_matches_keras_bert(token_dict, text):
+    keras_bert = pytest.importorskip("keras_bert")
+    reference = keras_bert.Tokenizer(token_dict)
+    fast = FastTokenizer(token_dict)
+    assert fast.encode(text) == reference.encode(text)
+    assert fast.encode(text, max_len=12) == reference.encode(text, max_len=12)
+    assert len(fast.tokenize(text)) == len(reference.tokenize(text))
+
+
+@pytest.mark.parametrize("text", TEXTS)
+def test_batch_encode_matches_encode(token_dict, text):
+    fast = FastTokenizer(token_dict)
+    assert list(fast.batch_encode([text])[0]) == fast.encode(text)[0]
+    token_ids = fast.encode(text, max_len=12)[0]
+    unpadded = min(len(fast.tokenize(text)), 12)
+    assert list(fast.batch_encode([text], max_len=12)[0]) == token_ids[:unpadded]
+    assert len(fast.tokenize(text)) == len(fast.encode(text)[0])